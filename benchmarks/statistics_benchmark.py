@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+Compares the float path of randopt.statistics with the exact Fraction path
+it falls back to for Decimal and Fraction data.
+
+Usage:
+
+    python benchmarks/statistics_benchmark.py [num_values]
+"""
+
+import sys
+import random
+import timeit
+
+from randopt import statistics
+
+
+def exact_mean(data):
+    T, total, count = statistics._sum(data)
+    return statistics._convert(total / count, T)
+
+
+def exact_pvariance(data):
+    c = exact_mean(data)
+    T, total, count = statistics._sum((x - c)**2 for x in data)
+    U, total2, count2 = statistics._sum((x - c) for x in data)
+    total -= total2**2 / count
+    return statistics._convert(total / count, T)
+
+
+if __name__ == '__main__':
+    num_values = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(1234)
+    data = [random.gauss(0.0, 1.0) for _ in range(num_values)]
+    for name, fast, exact in [('mean', statistics.mean, exact_mean),
+                              ('pvariance', statistics.pvariance,
+                               exact_pvariance)]:
+        assert abs(fast(data) - exact(data)) < 1e-12
+        t_fast = timeit.timeit(lambda: fast(data), number=1)
+        t_exact = timeit.timeit(lambda: exact(data), number=1)
+        print('N={} {}: fraction {:.3f}s, float {:.3f}s, speedup {:.1f}x'.format(
+            num_values, name, t_exact, t_fast, t_exact / t_fast))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+Compares the bounded-heap top-k used by Experiment.top with the former
+insertion-sort implementation.
+
+Usage:
+
+    python benchmarks/top_k_benchmark.py [num_results]
+"""
+
+import sys
+import random
+import timeit
+
+from randopt.experiment.experiment import top_k, leq
+
+
+class Result(object):
+
+    def __init__(self, result):
+        self.result = result
+
+
+def insertion_top_k(candidates, count, fn=leq):
+    top_n_experiments = []
+    for summary in candidates:
+        if len(top_n_experiments) < count:
+            inserted = False
+            for i in range(len(top_n_experiments)):
+                if fn(summary, top_n_experiments[i]):
+                    top_n_experiments.insert(i, summary)
+                    inserted = True
+                    break
+            if not inserted:
+                top_n_experiments.append(summary)
+        else:
+            for i in range(count):
+                if fn(summary, top_n_experiments[i]):
+                    top_n_experiments.insert(i, summary)
+                    top_n_experiments.pop()
+                    break
+    return top_n_experiments
+
+
+if __name__ == '__main__':
+    num_results = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(1234)
+    results = [Result(random.random()) for _ in range(num_results)]
+    for count in [10, 1000]:
+        heap = top_k(results, count)
+        insertion = insertion_top_k(results, count)
+        assert [r.result for r in heap] == [r.result for r in insertion]
+        t_heap = timeit.timeit(lambda: top_k(results, count), number=1)
+        t_insertion = timeit.timeit(lambda: insertion_top_k(results, count),
+                                    number=1)
+        print('N={} k={}: insertion {:.3f}s, heap {:.3f}s, speedup {:.1f}x'.format(
+            num_results, count, t_insertion, t_heap, t_insertion / t_heap))
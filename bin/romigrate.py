@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+"""
+Converts the results of an experiment folder from one storage backend to
+another.
+
+Example:
+    romigrate.py randopt_results/exp_name --destination log --remove
+
+    Copies all JSON summaries of exp_name to append-only log segments, and
+    removes the JSON files once they are copied.
+"""
+
+import argparse
+from randopt.experiment.storage import migrate, BACKENDS
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Randopt\'s storage migration')
+    parser.add_argument('path', help='path/to/experiment')
+    parser.add_argument('--source', default='json', choices=sorted(BACKENDS))
+    parser.add_argument('--destination', default='log',
+                        choices=sorted(BACKENDS))
+    parser.add_argument('--remove', action='store_true',
+                        help='remove results from the source backend')
+    args = parser.parse_args()
+    num = migrate(args.path, args.source, args.destination, args.remove)
+    print('Migrated', num, 'results from', args.source, 'to', args.destination)
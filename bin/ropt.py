@@ -4,34 +4,70 @@
 
 Allows sampling and hyper-parameter search from outside of Python.
 
-Note: ROPT_NPROC is currently unsupported, until I find a way to cleanly kill all
-      sub-processes.
-
 Example:
     ROPT_NSEARCH=16 ROPT_NPROC=4 ropt.py python example.py run --lr='Choice([0.1,0.2,0.3])' --wd='uniform(0,10)'
 
     Runs 16 searches with up to 4 processes in parallel (these are ropt.py parameters)
     of the command 'python example.py run --lr X --wd Y' where X is sampled from  the given 
     Choice distribution and Y is sampled from Uniform(0, 10).
+    When ROPT_NPROC is larger than 1, the output of each command is saved to
+    ROPT_LOGS/<pid>_<i>.out and .err (ROPT_LOGS defaults to ropt_logs).
+    Ctrl-C terminates all running commands.
+
+Commands can also be scheduled on resource slots, one command per slot:
+    ROPT_CPUS=4 pins each command to its own set of 4 cores (and sets OMP_NUM_THREADS).
+    ROPT_MEMORY=8G limits the memory (address space) of each command.
+    ROPT_SLOTS='CUDA_VISIBLE_DEVICES=0 1 2 3' gives each command one of the values of the variable.
+      Several variables are separated by ';', and their i-th values form the i-th slot.
+    The number of parallel commands is the smallest of ROPT_NPROC and of the number of slots.
+
+Failing commands:
+    ROPT_TIMEOUT=3600 terminates commands running for more than 3600 seconds (SIGTERM, then SIGKILL).
+    ROPT_STRAGGLER=0.9 terminates commands running twice as long as the 90th percentile of successful commands.
+    ROPT_RETRIES=2 runs failed and terminated commands up to 2 more times.
+    When ROPT_NAME is set, commands that failed for good are recorded in the experiment
+    with a null result and a status of 'failed', 'timeout' or 'straggler'.
+
+Persistent workers:
+    ROPT_WORKERS=1 starts the command (without the sampled arguments) once per slot, and
+    sends the sampled arguments of each trial to these workers. The command must call
+    randopt.command.parse(), which then runs the registered command once per trial in the
+    same process, so that imports and data loading happen only once per worker.
 
 Another example using Search wrappers is
 
     ROPT_TYPE=GridSearch ROPT_NAME=newton-2_experiment ropt.py CUDA_VISIBLE_DEVICES=0 python experiments.py main newton --lr="Choice([0.01,0.1])"
 
+Several ropt.py processes can split a grid-search between them, each sampling disjoint points:
+
+    ROPT_SHARD=0/4 ROPT_TYPE=GridSearch ROPT_NAME=grid ropt.py python experiments.py --lr="Choice([0.01,0.1])"
+
+runs the first of 4 shards of the grid (ROPT_SHARD=1/4, 2/4 and 3/4 run the others).
+
 The convention is to always pass sampled arguments to ropt with an = sign, to wrap the sampler in quotes (required by most shells), and avoid spaces within these quotes. The choice of quotes and the casing for samplers is irrelevant.
 """
 
 import os
 import sys
-import subprocess
-import multiprocessing as mp
+import signal
 import randopt as ro
 
+from randopt.executor import Executor, WorkerExecutor, Slot, cpu_slots
+
 ROPT_TYPE = 'ROPT_TYPE'
 ROPT_NAME = 'ROPT_NAME'
 ROPT_DIR = 'ROPT_DIR'
 ROPT_NSEARCH = 'ROPT_NSEARCH'
 ROPT_NPROC = 'ROPT_NPROC'
+ROPT_LOGS = 'ROPT_LOGS'
+ROPT_CPUS = 'ROPT_CPUS'
+ROPT_MEMORY = 'ROPT_MEMORY'
+ROPT_SLOTS = 'ROPT_SLOTS'
+ROPT_TIMEOUT = 'ROPT_TIMEOUT'
+ROPT_RETRIES = 'ROPT_RETRIES'
+ROPT_STRAGGLER = 'ROPT_STRAGGLER'
+ROPT_WORKERS = 'ROPT_WORKERS'
+ROPT_SHARD = 'ROPT_SHARD'
 
 
 class CommandGenerator(object):
@@ -39,13 +75,22 @@ class CommandGenerator(object):
         self.command = command
         self.parameters = parameters
         self.samplers = samplers
+        self.samples = {}
+        self.count = 0
 
     def __iter__(self):
         return self
 
-    def __next__(self):
+    def sample(self):
         values = [s.sample() for s in self.samplers]
-        return self.command.format(*values)
+        params = dict(zip(self.parameters, values))
+        self.samples[self.count] = params
+        self.count += 1
+        return params
+
+    def __next__(self):
+        params = self.sample()
+        return self.command.format(*[params[p] for p in self.parameters])
 
     next = __next__
 
@@ -56,15 +101,23 @@ class ExperimentSampler(object):
         self.experiment = experiment
         self.command = command
         self.parameters = parameters
+        self.samples = {}
+        self.count = 0
 
     def __iter__(self):
         return self
 
-    def __next__(self):
+    def sample(self):
         self.experiment.sample_all_params()
         current = self.experiment.current
-        values = [current[p] for p in self.parameters]
-        return self.command.format(*values)
+        params = {p: current[p] for p in self.parameters}
+        self.samples[self.count] = params
+        self.count += 1
+        return params
+
+    def __next__(self):
+        params = self.sample()
+        return self.command.format(*[params[p] for p in self.parameters])
 
     next = __next__
 
@@ -118,6 +171,54 @@ def parse_sampler(param):
     return samplers[sampler](*values)
 
 
+def parse_memory(param):
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    param = param.strip().upper().rstrip('B')
+    if param[-1] in units:
+        return int(float(param[:-1]) * units[param[-1]])
+    return int(param)
+
+
+def parse_slots(n_processes=None, cpus=None, memory=None, variables=None):
+    counts = [] if n_processes is None else [n_processes]
+    if cpus is not None:
+        cpus = cpu_slots(int(cpus))
+        counts.append(len(cpus))
+    if memory is not None:
+        memory = parse_memory(memory)
+    env = {}
+    if variables is not None:
+        for assignment in variables.split(';'):
+            if '=' not in assignment:
+                continue
+            name, values = assignment.split('=', 1)
+            env[name.strip()] = values.split()
+            counts.append(len(env[name.strip()]))
+    if len(counts) == 0:
+        counts.append(1)
+    return [Slot(cpus=cpus[i].cpus if cpus is not None else None,
+                 memory=memory,
+                 env={name: values[i] for name, values in env.items()})
+            for i in range(min(counts))]
+
+
+def record_failure(name, directory, params, job):
+    experiment = ro.Experiment(name=name,
+                               params={p: ro.Constant(v)
+                                       for p, v in params.items()},
+                               directory=directory)
+    experiment.add_result(None, data={
+        'status': job.status,
+        'returncode': job.returncode,
+        'attempts': job.attempts,
+    })
+
+
+def parse_shard(param):
+    shard_id, num_shards = param.split('/')
+    return int(shard_id), int(num_shards)
+
+
 def parse_experiment(param):
     if 'evo' in param.lower():
         return ro.Evolutionary
@@ -142,9 +243,32 @@ if __name__ == '__main__':
     n_searches = -1
     if ROPT_NSEARCH in os.environ:
         n_searches = int(os.environ[ROPT_NSEARCH]) 
-    n_processes = 1
+    n_processes = None
     if ROPT_NPROC in os.environ:
-        experiment_name = int(os.environ[ROPT_NPROC]) 
+        n_processes = int(os.environ[ROPT_NPROC])
+    slots = parse_slots(n_processes,
+                        os.environ.get(ROPT_CPUS, None),
+                        os.environ.get(ROPT_MEMORY, None),
+                        os.environ.get(ROPT_SLOTS, None))
+    log_dir = None
+    if ROPT_LOGS in os.environ:
+        log_dir = os.environ[ROPT_LOGS]
+    elif len(slots) > 1:
+        log_dir = 'ropt_logs'
+    timeout = None
+    if ROPT_TIMEOUT in os.environ:
+        timeout = float(os.environ[ROPT_TIMEOUT])
+    retries = 0
+    if ROPT_RETRIES in os.environ:
+        retries = int(os.environ[ROPT_RETRIES])
+    straggler = None
+    if ROPT_STRAGGLER in os.environ:
+        straggler = float(os.environ[ROPT_STRAGGLER])
+    use_workers = os.environ.get(ROPT_WORKERS, '0') not in ('', '0')
+    shard = {}
+    if ROPT_SHARD in os.environ:
+        shard_id, num_shards = parse_shard(os.environ[ROPT_SHARD])
+        shard = dict(shard_id=shard_id, num_shards=num_shards)
 
     print('Working on', experiment_name, 'in', experiment_dir)
 
@@ -152,6 +276,7 @@ if __name__ == '__main__':
     args_idx = 0
 
     command = ""
+    worker_command = ""
     parameters = []
     samplers = []
     for arg in arguments:
@@ -165,26 +290,48 @@ if __name__ == '__main__':
             samplers.append(sampler)
         else:
             command = command + ' ' + arg
+            worker_command = worker_command + ' ' + arg
 
     # Generate the right number of commands
     if experiment is not None and experiment_name is not None:
         print('Using ', experiment.__name__)
         print('sys: ', sys.argv)
         params = {p: s for p, s in zip(parameters, samplers)}
+        if experiment is not ro.GridSearch:
+            shard = {}
         experiment = experiment(ro.Experiment(name=experiment_name,
                                               params=params,
-                                              directory=experiment_dir))
+                                              directory=experiment_dir),
+                                **shard)
         command_generator = ExperimentSampler(command, parameters, experiment)
     else:
         command_generator = CommandGenerator(command, parameters, samplers)
 
+    if use_workers:
+        # Workers receive the sampled parameters instead of commands.
+        trials = iter(command_generator.sample, None)
+    else:
+        trials = command_generator
     if n_searches == -1:
         n_searches = float('inf')
-        commands = command_generator
+        commands = trials
     else:
-        commands = (next(command_generator) for _ in range(n_searches))
-
-    # Run until search finishes
-    for i, command in enumerate(commands):
-        print(i, ':', command)
-        subprocess.call(command, shell=True)
+        commands = (next(trials) for _ in range(n_searches))
+
+    def finished(job):
+        params = command_generator.samples.pop(job.index, {})
+        if job.status != 'ok' and experiment_name is not None:
+            record_failure(experiment_name, experiment_dir, params, job)
+
+    # Run until search finishes, one command per slot at a time
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    options = dict(log_dir=log_dir, slots=slots, timeout=timeout,
+                   retries=retries, straggler=straggler, callback=finished)
+    if use_workers:
+        executor = WorkerExecutor(worker_command, **options)
+    else:
+        executor = Executor(**options)
+    try:
+        executor.run(commands)
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -33,15 +33,6 @@ if __name__ == '__main__':
 
     print('optimal value: ', e.minimum())
 
-    import os
-    import json
-    max_lr = 0.0
-    for fname in os.listdir(e.hyperband_path):
-        base, ext = os.path.splitext(fname)
-        if 'json' in ext:
-            fname = os.path.join(e.hyperband_path, fname)
-            with open(fname, 'r') as f:
-                res = json.load(f)
-                if res['alpha'] > max_lr:
-                    max_lr = res['alpha']
+    e.brackets.refresh()
+    max_lr = max(res['alpha'] for res in e.brackets.runs.values())
     print('Max LR tried: ', max_lr)
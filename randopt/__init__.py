@@ -12,7 +12,7 @@ if 'RANDOP_INIT' not in globals():
 args = None
 
 from ._version import __version__
-from .experiment import Experiment, HyperBand, Evolutionary, GridSearch, SummaryList
+from .experiment import Experiment, HyperBand, ASHA, Evolutionary, GridSearch, SummaryList, Field, ResultLoader, Accumulators
 from .samplers import *
 from .command import cli, experiment, parse
 from .utils import dict_to_constants, dict_to_string, dict_to_list, dict_to_path
@@ -2,22 +2,62 @@
 
 """Utilities for custom command-line interfaces."""
 
+import os
 import sys
+import json
 import inspect
 import numbers
 import argparse
-import collections
+import traceback
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 
 import randopt as ro
 
+from randopt.executor import WORKER_FD
+
 __ARGUMENTS = {}
 __FUNCTIONS = {}
 __DOCS = {}
+__EXPERIMENTS = {}
+
+
+def _getargspec(fn):
+    if hasattr(inspect, 'getfullargspec'):
+        return inspect.getfullargspec(fn)
+    return inspect.getargspec(fn)
+
+
+def _split_result(result):
+    """Returns the (result, data, attachment) returned by an experiment."""
+    if isinstance(result, Iterable):
+        if len(result) == 2:
+            return result[0], result[1], None
+        elif len(result) == 3:
+            return result[0], result[1], result[2]
+        return None
+    return result, None, None
+
+
+def _is_json(value):
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
 
 
 def cli(fn=None):
     """Register decorator for command-line interface of general commands."""
-    argspec = inspect.getargspec(fn)
+    argspec = _getargspec(fn)
     arg_names = argspec[0]
     arg_defaults = argspec[3]
     if not len(arg_names) == len(arg_defaults):
@@ -44,12 +84,13 @@ def experiment(name, directory='randopt_results'):
     def experiment_decorator(fn):
         # Parse and register function
         cli(fn)
-        argspec = inspect.getargspec(fn)
+        argspec = _getargspec(fn)
         arg_names = argspec[0]
         arg_defaults = argspec[3]
 
         # Update registered function with experiment wrapper
         fn_name = fn.__name__
+        __EXPERIMENTS[fn_name] = (name, directory, fn)
 
         def wrapper(*args, **kwargs):
             params = {
@@ -62,21 +103,158 @@ def experiment(name, directory='randopt_results'):
             experiment = ro.Experiment(name=name,
                                        directory=directory,
                                        params=params)
-            result = fn(*args, **kwargs)
-            if isinstance(result, collections.Iterable):
-                if len(result) == 2:
-                    experiment.add_result(result[0], data=result[1])
-                elif len(result) == 3:
-                    experiment.add_result(result[0],
-                                          data=result[1],
-                                          attachment=result[2])
-            else:
-                experiment.add_result(result)
+            output = fn(*args, **kwargs)
+            result = _split_result(output)
+            if result is not None:
+                experiment.add_result(result[0],
+                                      data=result[1],
+                                      attachment=result[2])
+            return output
         __FUNCTIONS[fn_name] = wrapper
+        return fn
 
     return experiment_decorator
 
 
+def _call(fn, kwargs):
+    ro.args = argparse.Namespace(**kwargs)
+    return fn(**kwargs)
+
+
+def _call_all(fn, calls):
+    # Module-level, so that it can be sent to worker processes. Returns
+    # (output, error) pairs, so that a failed call does not lose the others.
+    outputs = []
+    for kwargs in calls:
+        try:
+            outputs.append((_call(fn, kwargs), None))
+        except Exception:
+            outputs.append((None, traceback.format_exc()))
+    return outputs
+
+
+def run_batch(fn_name, lines, workers=None, defaults=None):
+    """
+    Calls the registered command fn_name once for each JSON line of
+    arguments, in this process or across a pool of worker processes.
+    Missing arguments take their default value. For experiments, all
+    results are saved at the end with a single Experiment.add_results().
+
+    Calls that raise return None, and their traceback is written to stderr.
+    For experiments, they are saved with a null result and a status of
+    'failed', like the failed trials of ropt.py.
+
+    Parameters:
+
+    * fn_name - (string) name of the registered command.
+    * lines - (iterable) JSON dicts of arguments, one per call.
+    * workers - (int) number of worker processes, or None to call in this process. Default: None
+    * defaults - (dict) arguments of the calls missing from lines. Default: defaults of fn_name
+
+    Return type: list
+
+    Example:
+
+        with open('params.jsonl') as f:
+            run_batch('train', f, workers=8)
+    """
+    if defaults is None:
+        defaults = __ARGUMENTS[fn_name]
+    calls = []
+    for line in lines:
+        if len(line.strip()) > 0:
+            kwargs = dict(defaults)
+            kwargs.update(json.loads(line))
+            calls.append(kwargs)
+    if fn_name in __EXPERIMENTS:
+        name, directory, fn = __EXPERIMENTS[fn_name]
+    else:
+        name, directory, fn = None, None, __FUNCTIONS[fn_name]
+    if workers is None or workers < 2 or ProcessPoolExecutor is None:
+        outputs = _call_all(fn, calls)
+    else:
+        # Calls are sent in chunks, to amortize the cost of pickling.
+        chunksize = max(1, len(calls) // (4 * workers))
+        chunks = [calls[i:i + chunksize]
+                  for i in range(0, len(calls), chunksize)]
+        with ProcessPoolExecutor(workers) as pool:
+            outputs = [output
+                       for outputs in pool.map(_call_all, [fn] * len(chunks),
+                                               chunks)
+                       for output in outputs]
+    records = []
+    for kwargs, (output, error) in zip(calls, outputs):
+        if error is not None:
+            sys.stderr.write(error)
+            records.append({'result': None, 'params': kwargs,
+                            'data': {'status': 'failed', 'error': error}})
+            continue
+        output = _split_result(output)
+        if output is not None:
+            records.append({'result': output[0], 'params': kwargs,
+                            'data': output[1], 'attachment': output[2]})
+    if name is not None:
+        experiment = ro.Experiment(name=name, directory=directory,
+                                   params=ro.dict_to_constants(defaults))
+        experiment.add_results(records)
+    return [output for output, error in outputs]
+
+
+def run_worker(fn_name, defaults=None, requests=None, fd=None):
+    """
+    Runs the registered command fn_name for each request until requests
+    end, as a worker started by ropt.py with ROPT_WORKERS=1.
+
+    Requests are JSON lines {"id": ..., "params": {...}}, read from stdin
+    by default. For each of them, a JSON line {"id": ..., "status": "ok",
+    "result": ...} is written to file descriptor fd (default: the
+    ROPT_WORKER_FD environment variable), or {"id": ..., "status":
+    "failed", "error": ...} if the command raised.
+
+    Parameters:
+
+    * fn_name - (string) name of the registered command.
+    * defaults - (dict) arguments of the calls missing from requests. Default: defaults of fn_name
+    * requests - (file) JSON lines of requests. Default: sys.stdin
+    * fd - (int) file descriptor of the responses. Default: ROPT_WORKER_FD
+
+    Return type: n/a
+
+    Example:
+
+        run_worker('train')
+    """
+    if defaults is None:
+        defaults = __ARGUMENTS[fn_name]
+    if requests is None:
+        requests = sys.stdin
+    if fd is None:
+        fd = int(os.environ.pop(WORKER_FD))
+    function = __FUNCTIONS[fn_name]
+    with os.fdopen(fd, 'wb') as responses:
+        # readline() does not wait for more input, unlike iteration.
+        for line in iter(requests.readline, ''):
+            if len(line.strip()) == 0:
+                continue
+            request = json.loads(line)
+            kwargs = dict(defaults)
+            kwargs.update(request['params'])
+            response = {'id': request['id'], 'status': 'ok'}
+            try:
+                output = _split_result(_call(function, kwargs))
+            except Exception:
+                response['status'] = 'failed'
+                response['error'] = traceback.format_exc()
+                sys.stderr.write(response['error'])
+            else:
+                if output is not None and _is_json(output[0]):
+                    response['result'] = output[0]
+            sys.stdout.flush()
+            sys.stderr.flush()
+            responses.write((json.dumps(response) + '\n').encode('utf-8'))
+            responses.flush()
+
+
 def parse():
     """
     Parse arguments and execute commands registered via the
@@ -109,6 +287,13 @@ def parse():
 
     func_def = __ARGUMENTS[arguments[0]]
     parser = argparse.ArgumentParser('Randopt\'s custom argument parser')
+    if 'batch' not in func_def:
+        parser.add_argument('--batch', type=str, default=None,
+                            help='JSON lines file of arguments (- for stdin), '
+                                 'one call per line.')
+    if 'workers' not in func_def:
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of processes for --batch calls.')
     for arg in func_def:
         if isinstance(func_def[arg], numbers.Number):
             arg_type = type(func_def[arg])
@@ -120,6 +305,19 @@ def parse():
                             required=False)
 
     parsed = parser.parse_args(arguments[1:])
+    kwargs = vars(parsed)
+    batch = kwargs.pop('batch') if 'batch' not in func_def else None
+    workers = kwargs.pop('workers') if 'workers' not in func_def else None
+    if WORKER_FD in os.environ:
+        run_worker(arguments[0], kwargs)
+        return
+    if batch is not None:
+        if batch == '-':
+            run_batch(arguments[0], sys.stdin, workers, kwargs)
+        else:
+            with open(batch, 'r') as f:
+                run_batch(arguments[0], f, workers, kwargs)
+        return
     function = __FUNCTIONS[arguments[0]]
     ro.args = parsed
-    function(**vars(parsed))
+    function(**kwargs)
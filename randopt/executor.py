@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+
+"""
+This file implements the Executor, which runs shell commands in parallel
+local processes for ropt.py, and the resource Slots it schedules them on.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import select
+import signal
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+POLL_INTERVAL = 0.05
+KILL_TIMEOUT = 5.0
+MIN_RUNTIMES = 5
+WORKER_FD = 'ROPT_WORKER_FD'
+
+
+class Slot(object):
+
+    """
+    Resources given to one running command.
+
+    Parameters:
+
+    * cpus - (list) CPU cores the command is pinned to. Default: None
+    * memory - (int) limit of the address space of the command, in bytes. Default: None
+    * env - (dict) environment variables set for the command. Default: None
+
+    Return type: n/a
+
+    Example:
+
+        slots = [Slot(env={'CUDA_VISIBLE_DEVICES': str(i)}) for i in range(4)]
+        executor = Executor(slots=slots)
+    """
+
+    def __init__(self, cpus=None, memory=None, env=None):
+        if cpus is not None and not hasattr(os, 'sched_setaffinity'):
+            raise ValueError('CPU pinning is not supported on this platform.')
+        if memory is not None and resource is None:
+            raise ValueError('Memory limits are not supported on this platform.')
+        self.cpus = list(cpus) if cpus is not None else None
+        self.memory = memory
+        self.env = dict(env) if env is not None else {}
+
+    def __repr__(self):
+        return 'Slot(cpus={}, memory={}, env={})'.format(self.cpus,
+                                                          self.memory,
+                                                          self.env)
+
+    def environment(self):
+        if self.cpus is None and len(self.env) == 0:
+            return None
+        env = dict(os.environ)
+        if self.cpus is not None and 'OMP_NUM_THREADS' not in env:
+            env['OMP_NUM_THREADS'] = str(len(self.cpus))
+        env.update(self.env)
+        return env
+
+    def limit(self):
+        if self.cpus is None and self.memory is None:
+            return None
+
+        def preexec():
+            # Runs in the child process, before the command starts.
+            if self.cpus is not None:
+                os.sched_setaffinity(0, self.cpus)
+            if self.memory is not None:
+                resource.setrlimit(resource.RLIMIT_AS,
+                                   (self.memory, self.memory))
+        return preexec
+
+
+def cpu_slots(cpus_per_job, cpus=None, memory=None):
+    '''
+    Returns slots pinned to disjoint sets of cpus_per_job cores.
+
+    Parameters:
+
+    * cpus_per_job - (int) number of cores of each slot.
+    * cpus - (list) cores to split. Default: cores available to this process
+    * memory - (int) memory limit of each slot, in bytes. Default: None
+
+    Return type: list
+
+    Example:
+
+        executor = Executor(slots=cpu_slots(4))
+    '''
+    if cpus is None:
+        if not hasattr(os, 'sched_getaffinity'):
+            raise ValueError('CPU pinning is not supported on this platform.')
+        cpus = os.sched_getaffinity(0)
+    cpus = sorted(cpus)
+    return [Slot(cpus=cpus[i:i + cpus_per_job], memory=memory)
+            for i in range(0, len(cpus) - cpus_per_job + 1, cpus_per_job)]
+
+
+class Job(object):
+
+    """
+    A command and the process currently running it.
+
+    The status is None while the command runs, and one of 'ok', 'failed',
+    'timeout', or 'straggler' once its last attempt finished.
+    """
+
+    def __init__(self, index, command, slot=None):
+        self.index = index
+        self.command = command
+        self.slot = slot
+        self.process = None
+        self.logs = ()
+        self.attempts = 0
+        self.started = None
+        self.runtime = None
+        self.status = None
+        self.killed = None
+        self.returncode = None
+        self.result = None
+
+    def poll(self):
+        return self.process.poll()
+
+    def signal(self, sig):
+        try:
+            if hasattr(os, 'killpg'):
+                # The job leads its own process group, which also holds the
+                # processes the command started.
+                os.killpg(self.process.pid, sig)
+            else:
+                self.process.send_signal(sig)
+        except OSError:
+            pass
+
+    def terminate(self, status):
+        if self.killed is None:
+            self.status = status
+            self.killed = time.time()
+            self.signal(signal.SIGTERM)
+
+    def kill(self):
+        self.signal(signal.SIGKILL if hasattr(signal, 'SIGKILL')
+                    else signal.SIGTERM)
+
+    def close(self):
+        for log in self.logs:
+            log.close()
+        self.logs = ()
+
+
+class Executor(object):
+
+    """
+    Runs shell commands with up to n_processes of them at once.
+
+    When slots are given, each running command holds one of them, so that
+    as many commands as slots run at once, with the CPU cores, memory limit
+    and environment variables of their slot. Commands are drawn from the
+    iterable only when a slot is free, so that samplers see the results of
+    finished commands.
+
+    Each command runs in its own process group. Commands running for more
+    than timeout seconds, or for more than straggler_factor times the
+    straggler quantile of the runtimes of successful commands, are
+    terminated, then killed after kill_timeout seconds. Failed and
+    terminated commands are run again up to retries times. On Ctrl-C or
+    any other error, all running commands and their children are
+    terminated.
+
+    Parameters:
+
+    * n_processes - (int) maximum number of commands running at once. Default: 1
+    * log_dir - (string) directory of the stdout and stderr files of commands, or None to inherit them. Default: None
+    * kill_timeout - (float) seconds between SIGTERM and SIGKILL. Default: 5.0
+    * verbose - (bool) print commands as they start and fail. Default: True
+    * slots - (list) Slots to run commands on, instead of n_processes. Default: None
+    * timeout - (float) maximum seconds a command may run. Default: None
+    * retries - (int) number of times a failed command is run again. Default: 0
+    * straggler - (float) quantile of the runtimes of successful commands used to detect stragglers. Default: None
+    * straggler_factor - (float) how much slower than the quantile a straggler is. Default: 2.0
+    * callback - (function) called with each Job once it finished for good. Default: None
+
+    Return type: n/a
+
+    Example:
+
+        executor = Executor(n_processes=4, log_dir='ropt_logs', timeout=3600,
+                            retries=2, straggler=0.9)
+        executor.run(['python train.py --lr 0.1', 'python train.py --lr 0.2'])
+    """
+
+    def __init__(self, n_processes=1, log_dir=None, kill_timeout=KILL_TIMEOUT,
+                 verbose=True, slots=None, timeout=None, retries=0,
+                 straggler=None, straggler_factor=2.0, callback=None):
+        if slots is None:
+            slots = [Slot() for _ in range(max(1, n_processes))]
+        if len(slots) == 0:
+            raise ValueError('Executor requires at least one slot.')
+        self.slots = slots
+        self.log_dir = log_dir
+        self.kill_timeout = kill_timeout
+        self.verbose = verbose
+        self.timeout = timeout
+        self.retries = retries
+        self.straggler = straggler
+        self.straggler_factor = straggler_factor
+        self.callback = callback
+        self.running = []
+        self.runtimes = []
+        self._free = list(slots)
+
+    def run(self, commands):
+        '''
+        Runs all commands, and returns their exit codes in order.
+
+        Parameters:
+
+        * commands - (iterable) shell commands to run.
+
+        Return type: list
+
+        Example:
+
+            codes = executor.run(command_generator)
+        '''
+        if self.log_dir is not None and not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        codes = []
+        commands = iter(commands)
+        exhausted = False
+        try:
+            while not exhausted or len(self.running) > 0:
+                while not exhausted and len(self._free) > 0:
+                    try:
+                        command = next(commands)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    codes.append(None)
+                    job = Job(len(codes) - 1, command, self._free.pop(0))
+                    self.running.append(job)
+                    self._start(job)
+                self._check_time()
+                if not self._reap(codes):
+                    time.sleep(POLL_INTERVAL)
+        except BaseException:
+            self.shutdown()
+            raise
+        return codes
+
+    def shutdown(self):
+        '''
+        Terminates all running commands and their children.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            executor.shutdown()
+        '''
+        for job in self.running:
+            job.signal(signal.SIGTERM)
+        deadline = time.time() + self.kill_timeout
+        while time.time() < deadline and \
+                any(job.poll() is None for job in self.running):
+            time.sleep(POLL_INTERVAL)
+        for job in self.running:
+            job.kill()
+            job.process.wait()
+            job.close()
+            self._free.append(job.slot)
+        self.running = []
+
+    def straggler_time(self):
+        '''
+        Returns the runtime after which commands are stragglers, or None
+        while too few commands succeeded to tell.
+
+        Parameters: n/a
+
+        Return type: float
+
+        Example:
+
+            executor.straggler_time()
+        '''
+        if self.straggler is None or len(self.runtimes) < MIN_RUNTIMES:
+            return None
+        position = int(self.straggler * (len(self.runtimes) - 1))
+        return self.straggler_factor * self.runtimes[position]
+
+    def _start(self, job):
+        job.attempts += 1
+        job.status = None
+        job.killed = None
+        if self.verbose:
+            attempt = '' if job.attempts == 1 else \
+                ' (attempt ' + str(job.attempts) + ')'
+            print(str(job.index) + attempt, ':', job.command)
+            sys.stdout.flush()
+        stdout = stderr = None
+        if self.log_dir is not None:
+            prefix = os.path.join(self.log_dir,
+                                  str(os.getpid()) + '_' + str(job.index))
+            # Attempts of the same command share its log files.
+            stdout = open(prefix + '.out', 'ab')
+            stderr = open(prefix + '.err', 'ab')
+            job.logs = (stdout, stderr)
+        try:
+            job.process = subprocess.Popen(
+                job.command, shell=True, stdout=stdout, stderr=stderr,
+                env=job.slot.environment(), preexec_fn=job.slot.limit(),
+                start_new_session=hasattr(os, 'killpg'))
+        except BaseException:
+            job.close()
+            self.running.remove(job)
+            self._free.insert(0, job.slot)
+            raise
+        job.started = time.time()
+
+    def _check_time(self):
+        now = time.time()
+        straggler_time = self.straggler_time()
+        for job in self.running:
+            if job.killed is not None:
+                if now - job.killed > self.kill_timeout:
+                    job.kill()
+                continue
+            runtime = now - job.started
+            if self.timeout is not None and runtime > self.timeout:
+                job.terminate('timeout')
+            elif straggler_time is not None and runtime > straggler_time:
+                job.terminate('straggler')
+
+    def _reap(self, codes):
+        finished = [job for job in self.running if job.poll() is not None]
+        for job in finished:
+            job.close()
+            job.returncode = job.process.returncode
+            self._finish(job, codes)
+        return len(finished) > 0
+
+    def _finish(self, job, codes):
+        job.runtime = time.time() - job.started
+        if job.status is None:
+            job.status = 'ok' if job.returncode == 0 else 'failed'
+        if job.status == 'ok':
+            bisect.insort(self.runtimes, job.runtime)
+        elif self.verbose:
+            sys.stderr.write(str(job.index) + ' : ' + job.status +
+                             ' with code ' + str(job.returncode) + '\n')
+        if job.status != 'ok' and job.attempts <= self.retries:
+            self._start(job)
+            return
+        self.running.remove(job)
+        self._free.append(job.slot)
+        codes[job.index] = job.returncode
+        if self.callback is not None:
+            self.callback(job)
+
+
+class Worker(object):
+
+    """
+    A long-lived process of a command run in worker mode.
+
+    Requests are written as JSON lines to the stdin of the worker, and
+    responses are read from a pipe whose file descriptor is given to the
+    worker in the ROPT_WORKER_FD environment variable.
+    """
+
+    def __init__(self, command, slot, logs=()):
+        read_fd, write_fd = os.pipe()
+        env = slot.environment()
+        if env is None:
+            env = dict(os.environ)
+        env[WORKER_FD] = str(write_fd)
+        stdout, stderr = logs if len(logs) == 2 else (None, None)
+        try:
+            self.process = subprocess.Popen(
+                command, shell=True, stdin=subprocess.PIPE, stdout=stdout,
+                stderr=stderr, env=env, preexec_fn=slot.limit(),
+                start_new_session=hasattr(os, 'killpg'),
+                pass_fds=(write_fd, ))
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self.fd = read_fd
+        self.logs = logs
+        self._buffer = b''
+
+    def send(self, request):
+        try:
+            self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            # The worker died, which receive() reports.
+            pass
+
+    def receive(self):
+        '''
+        Returns the list of responses available, or None once the worker
+        closed its end of the pipe.
+        '''
+        data = os.read(self.fd, 1 << 16)
+        if len(data) == 0:
+            return None
+        self._buffer += data
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        return [json.loads(line.decode('utf-8')) for line in lines if line]
+
+    def close(self, timeout=KILL_TIMEOUT):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        deadline = time.time() + timeout
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                self.process.kill()
+            self.process.wait()
+        os.close(self.fd)
+        for log in self.logs:
+            log.close()
+
+
+class WorkerExecutor(Executor):
+
+    """
+    Runs the trials of a search on long-lived worker processes of command,
+    one per slot, instead of one process per trial.
+
+    Workers are started once, and run randopt.command.parse() in worker
+    mode: they call the registered command for each set of parameters they
+    receive. Each trial is a dict of parameters, and its Job gets the
+    result the command returned. Workers running a trial past its timeout,
+    or that die, are restarted for the next trials.
+
+    Parameters:
+
+    * command - (string) shell command starting a worker, without the sampled parameters.
+    * n_processes, log_dir, kill_timeout, verbose, slots, timeout, retries, straggler, straggler_factor, callback - See Executor.
+
+    Return type: n/a
+
+    Example:
+
+        executor = WorkerExecutor('python example.py run', n_processes=4)
+        executor.run([{'lr': 0.1}, {'lr': 0.01}])
+    """
+
+    def __init__(self, command, **kwargs):
+        super(WorkerExecutor, self).__init__(**kwargs)
+        self.command = command
+        self.workers = {}
+
+    def run(self, trials):
+        '''
+        Runs all trials, and returns their exit codes in order: 0 when the
+        command returned, 1 when it raised, and the exit code of the worker
+        when it died.
+
+        Parameters:
+
+        * trials - (iterable) dicts of parameters.
+
+        Return type: list
+
+        Example:
+
+            codes = executor.run([{'lr': 0.1}, {'lr': 0.01}])
+        '''
+        try:
+            return super(WorkerExecutor, self).run(trials)
+        finally:
+            self.close()
+
+    def close(self):
+        '''
+        Stops all workers.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            executor.close()
+        '''
+        for worker in self.workers.values():
+            worker.close(self.kill_timeout)
+        self.workers = {}
+
+    def shutdown(self):
+        super(WorkerExecutor, self).shutdown()
+        self.close()
+
+    def _worker(self, slot):
+        worker = self.workers.get(id(slot), None)
+        if worker is not None and worker.process.poll() is not None:
+            worker.close(0.0)
+            worker = None
+        if worker is None:
+            logs = ()
+            if self.log_dir is not None:
+                if not os.path.exists(self.log_dir):
+                    os.makedirs(self.log_dir)
+                prefix = os.path.join(self.log_dir, str(os.getpid()) +
+                                      '_worker' + str(self.slots.index(slot)))
+                logs = (open(prefix + '.out', 'ab'), open(prefix + '.err', 'ab'))
+            worker = Worker(self.command, slot, logs)
+            self.workers[id(slot)] = worker
+        return worker
+
+    def _start(self, job):
+        job.attempts += 1
+        job.status = None
+        job.killed = None
+        if self.verbose:
+            attempt = '' if job.attempts == 1 else \
+                ' (attempt ' + str(job.attempts) + ')'
+            print(str(job.index) + attempt, ':', json.dumps(job.command))
+            sys.stdout.flush()
+        try:
+            worker = self._worker(job.slot)
+        except BaseException:
+            self.running.remove(job)
+            self._free.insert(0, job.slot)
+            raise
+        job.process = worker.process
+        job.started = time.time()
+        worker.send({'id': job.index, 'params': job.command})
+
+    def _reap(self, codes):
+        busy = {}
+        for job in self.running:
+            busy[self.workers[id(job.slot)].fd] = job
+        readable = select.select(list(busy.keys()), [], [], POLL_INTERVAL)[0]
+        finished = []
+        for fd in readable:
+            job = busy[fd]
+            worker = self.workers[id(job.slot)]
+            responses = worker.receive()
+            if responses is None:
+                # The worker died, or was killed by _check_time.
+                worker.process.wait()
+                job.returncode = worker.process.returncode
+                if job.returncode == 0:
+                    job.returncode = 1
+                finished.append(job)
+                continue
+            for response in responses:
+                if response.get('id', None) == job.index:
+                    job.result = response.get('result', None)
+                    job.returncode = 0 if response['status'] == 'ok' else 1
+                    finished.append(job)
+        for job in finished:
+            self._finish(job, codes)
+        # Results arrive through select, which already waited.
+        return True
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 from .experiment import Experiment, SummaryList
+from .query import Field
+from .index import ResultLoader
+from .accumulators import Accumulators
 from .hyperband import HyperBand
+from .asha import ASHA
 from .evolutionary import Evolutionary
 from .grid_search import GridSearch
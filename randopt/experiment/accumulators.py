@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+import math
+import numbers
+
+"""
+This file implements one-pass, mergeable accumulators of statistics over
+the results of an experiment.
+"""
+
+COMPRESSION = 100
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _add_partial(partials, x):
+    # Shewchuk's exact summation, as used by math.fsum: partials are
+    # non-overlapping floats whose sum is exactly the sum of the inputs.
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x + y
+        lo = y - (hi - x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
+
+
+class TDigest(object):
+
+    """
+    Sketch of a distribution answering approximate quantiles in bounded
+    memory, following the merging t-digest of Dunning and Ertl.
+
+    Values are buffered and merged into at most about compression
+    centroids. Centroids are small at the tails, so that extreme quantiles
+    stay accurate.
+
+    Parameters:
+
+    * compression - (int) accuracy of the digest. Default: 100
+
+    Return type: n/a
+
+    Example:
+
+        digest = TDigest()
+        for x in values:
+            digest.add(x)
+        digest.quantile(0.99)
+    """
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.min = None
+        self.max = None
+        self._buffer = []
+
+    def __len__(self):
+        return int(sum(self.weights) + sum(w for _, w in self._buffer))
+
+    def add(self, value, weight=1):
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self._buffer.append((value, weight))
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        '''
+        Adds the values summarized by other to the digest.
+
+        Parameters:
+
+        * other - (TDigest) digest to merge.
+
+        Return type: TDigest
+
+        Example:
+
+            digest.merge(worker_digest)
+        '''
+        if other.min is None:
+            return self
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self._buffer.extend(zip(other.means, other.weights))
+        self._buffer.extend(other._buffer)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        '''
+        Returns an estimate of the q-th quantile of the values.
+
+        Parameters:
+
+        * q - (float) quantile, between 0 and 1.
+
+        Return type: float
+
+        Example:
+
+            median = digest.quantile(0.5)
+        '''
+        if len(self._buffer) > 0:
+            self._compress()
+        if len(self.means) == 0:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        # Centroids are placed at the middle of their weight, and values in
+        # between are linearly interpolated.
+        total = sum(self.weights)
+        target = q * total
+        cumulative = 0.0
+        position, value = 0.0, self.min
+        for mean, weight in zip(self.means, self.weights):
+            center = cumulative + weight / 2.0
+            if target < center:
+                return value + (mean - value) * (target - position) / \
+                    (center - position)
+            position, value = center, mean
+            cumulative += weight
+        if total <= position:
+            return self.max
+        return value + (self.max - value) * (target - position) / \
+            (total - position)
+
+    def _scale(self, q):
+        return self.compression * math.asin(2.0 * q - 1.0) / (2.0 * math.pi)
+
+    def _compress(self):
+        points = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = float(sum(w for _, w in points))
+        means, weights = [], []
+        cumulative = 0.0
+        left = self._scale(0.0)
+        for mean, weight in points:
+            q = min(1.0, (cumulative + weight) / total)
+            if len(means) > 0 and self._scale(q) - left <= 1.0:
+                merged = weights[-1] + weight
+                means[-1] += (mean - means[-1]) * weight / merged
+                weights[-1] = merged
+            else:
+                left = self._scale(cumulative / total)
+                means.append(mean)
+                weights.append(weight)
+            cumulative += weight
+        self.means = means
+        self.weights = weights
+
+
+class Accumulator(object):
+
+    """
+    One-pass statistics of a stream of numbers: count, sum, mean, variance,
+    min, max, and approximate quantiles.
+
+    The sum is exact, the mean and variance use Welford's algorithm, and
+    quantiles are estimated with a TDigest. Accumulators filled on
+    different workers combine with merge(): count, sum, min, and max are
+    exactly those of a single pass over all values.
+
+    Parameters:
+
+    * compression - (int) accuracy of the quantile estimates. Default: 100
+
+    Return type: n/a
+
+    Example:
+
+        acc = Accumulator()
+        for res in exp.all_results():
+            acc.add(res.result)
+        acc.mean, acc.std, acc.quantile(0.9)
+    """
+
+    def __init__(self, compression=COMPRESSION):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+        self._partials = []
+        self.digest = TDigest(compression)
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        _add_partial(self._partials, value)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.digest.add(value)
+
+    def merge(self, other):
+        '''
+        Adds the values accumulated by other.
+
+        Parameters:
+
+        * other - (Accumulator) accumulator to merge.
+
+        Return type: Accumulator
+
+        Example:
+
+            total = Accumulator()
+            for acc in worker_accumulators:
+                total.merge(acc)
+        '''
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        # Chan et al.'s pairwise update of Welford's statistics.
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        for x in other._partials:
+            _add_partial(self._partials, x)
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        self.digest.merge(other.digest)
+        return self
+
+    @property
+    def sum(self):
+        return math.fsum(self._partials)
+
+    @property
+    def variance(self):
+        # Population variance, like SummaryList.variance.
+        if self.count == 0:
+            return None
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        if self.count == 0:
+            return None
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        return self.digest.quantile(q)
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+
+class Accumulators(object):
+
+    """
+    Accumulators of several keys of results, filled in a single pass.
+
+    Numeric keys get one Accumulator, and keys holding lists of numbers get
+    one Accumulator per element, like SummaryList.map. Other values, and
+    values whose shape (scalar or list, and list length) differs from the
+    first value of their key, are ignored. Statistics are read with the same methods as SummaryList, and
+    Accumulators built on different workers combine with merge().
+
+    Parameters:
+
+    * keys - (list) keys to accumulate. Default: all numeric keys
+    * compression - (int) accuracy of the quantile estimates. Default: 100
+
+    Return type: n/a
+
+    Example:
+
+        stats = exp.stats()
+        stats.mean(), stats.std('alpha'), stats.quantile(0.9)
+    """
+
+    def __init__(self, keys=None, compression=COMPRESSION):
+        self.keys = keys
+        self.compression = compression
+        self.accumulators = {}
+
+    def __contains__(self, key):
+        return key in self.accumulators
+
+    def __getitem__(self, key):
+        return self.accumulators[key]
+
+    def add(self, summary):
+        keys = self.keys if self.keys is not None else summary.keys()
+        for key in keys:
+            value = summary.get(key, None)
+            if _is_number(value):
+                accumulator = self._accumulator(key)
+                if accumulator is not None:
+                    accumulator.add(value)
+            elif isinstance(value, list) and all(_is_number(v) for v in value):
+                accumulators = self._accumulator(key, len(value))
+                for acc, v in zip(accumulators or [], value):
+                    acc.add(v)
+
+    def update(self, summaries):
+        for summary in summaries:
+            self.add(summary)
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the results accumulated by other.
+
+        Parameters:
+
+        * other - (Accumulators) accumulators to merge.
+
+        Return type: Accumulators
+
+        Example:
+
+            stats = Accumulators().update(part1).merge(
+                Accumulators().update(part2))
+        '''
+        for key, value in other.accumulators.items():
+            if isinstance(value, list):
+                accumulators = self._accumulator(key, len(value))
+                for acc, other_acc in zip(accumulators or [], value):
+                    acc.merge(other_acc)
+            else:
+                accumulator = self._accumulator(key)
+                if accumulator is not None:
+                    accumulator.merge(value)
+        return self
+
+    def _accumulator(self, key, length=None):
+        if key not in self.accumulators:
+            if length is None:
+                self.accumulators[key] = Accumulator(self.compression)
+            else:
+                self.accumulators[key] = [Accumulator(self.compression)
+                                          for _ in range(length)]
+        accumulators = self.accumulators[key]
+        if isinstance(accumulators, list) != (length is not None):
+            # Scalars and lists never share a key.
+            return None
+        if length is not None and len(accumulators) != length:
+            # Nor do lists of different lengths.
+            return None
+        return accumulators
+
+    def _get(self, key, fn):
+        value = self.accumulators.get(key, None)
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return [fn(acc) for acc in value]
+        return fn(value)
+
+    def count(self, key='result'):
+        return self._get(key, lambda acc: acc.count)
+
+    def sum(self, key='result'):
+        return self._get(key, lambda acc: acc.sum)
+
+    def min(self, key='result'):
+        return self._get(key, lambda acc: acc.min)
+
+    def max(self, key='result'):
+        return self._get(key, lambda acc: acc.max)
+
+    def mean(self, key='result'):
+        return self._get(key, lambda acc: acc.mean)
+
+    def variance(self, key='result'):
+        return self._get(key, lambda acc: acc.variance)
+
+    def std(self, key='result'):
+        return self._get(key, lambda acc: acc.std)
+
+    def median(self, key='result'):
+        return self._get(key, lambda acc: acc.median)
+
+    def quantile(self, q, key='result'):
+        return self._get(key, lambda acc: acc.quantile(q))
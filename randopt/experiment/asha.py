@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import bisect
+
+from math import ceil
+
+from .experiment import Experiment
+from .query import leq, score_key
+from .index import append_lines, read_lines
+
+"""
+This file implements the ASHA experiment, and the append-only log of rung
+scores it shares between workers.
+"""
+
+RUNG_FILE = '_asha'
+
+
+class Rungs(object):
+
+    """
+    Scores reached by trials at each rung, kept sorted from best to worst.
+
+    Scores are appended to a log file shared by all workers, and each
+    worker only reads the lines appended since its last refresh.
+
+    Parameters:
+
+    * path - (string) path to the log file.
+    * comparator - (function) comparison of results, as for Experiment.top. Default: leq
+
+    Return type: n/a
+
+    Example:
+
+        rungs = Rungs(os.path.join(exp.experiment_path, RUNG_FILE))
+        rungs.add(0, 0.5)
+        rungs.rank(0, 0.5)
+    """
+
+    def __init__(self, path, comparator=leq):
+        self.path = path
+        self.comparator = comparator
+        self.rungs = {}
+        self._offset = 0
+        self._key = score_key(comparator)
+
+    def refresh(self):
+        '''
+        Reads the scores added by other workers since the last refresh.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            rungs.refresh()
+        '''
+        lines, self._offset = read_lines(self.path, self._offset)
+        for line in lines:
+            entry = json.loads(line.decode('utf-8'))
+            self._insert(entry['rung'], entry['score'])
+
+    def add(self, rung, score):
+        '''
+        Records score at rung, and returns the number of scores at rung.
+
+        Parameters:
+
+        * rung - (int) index of the rung.
+        * score - (float) score of the trial at rung.
+
+        Return type: int
+
+        Example:
+
+            rungs.add(0, 0.5)
+        '''
+        append_lines(self.path, [json.dumps({'rung': rung, 'score': score})])
+        # Our own line is read back along with those of other workers.
+        self.refresh()
+        return len(self.rungs.get(rung, []))
+
+    def rank(self, rung, score):
+        '''
+        Returns the number of scores at rung strictly better than score.
+
+        Parameters:
+
+        * rung - (int) index of the rung.
+        * score - (float) score to rank.
+
+        Return type: int
+
+        Example:
+
+            rungs.rank(0, 0.5)
+        '''
+        return bisect.bisect_left(self.rungs.get(rung, []), self._key(score))
+
+    def scores(self, rung):
+        return [key.obj for key in self.rungs.get(rung, [])]
+
+    def _insert(self, rung, score):
+        if rung not in self.rungs:
+            self.rungs[rung] = []
+        bisect.insort(self.rungs[rung], self._key(score))
+
+
+class ASHA(Experiment):
+
+    """
+    Asynchronous Successive Halving, based on
+    https://arxiv.org/abs/1810.05934
+
+    Each trial reports its score after every iteration through stop().
+    At iterations min_iter * eta**k, the trial is ranked against all
+    scores recorded by previous trials at that rung, and continues only
+    if it is in the top 1/eta of them. Unlike HyperBand, trials never wait
+    for others to fill a bracket: rankings use the scores recorded so far.
+
+    Parameters:
+
+    * name - (string) name of experiment.
+    * params - (dict) dicitionary of parameter names to their random sampling functions.
+    * num_iter - (int) maximum number of iterations of a trial.
+    * min_iter - (int) iteration of the first rung. Default: 1
+    * eta - (float) reduction factor between rungs. Default: 3
+    * comparator - (function) comparison of results. Default: leq
+    * kwargs - See Experiment.
+
+    Return type: n/a
+
+    Example:
+
+        e = ro.ASHA('asha', {'lr': ro.Uniform(0.0, 0.1)}, num_iter=81)
+        e.sample_all_params()
+        for epoch in range(81):
+            loss = train(e.lr)
+            if e.stop(loss):
+                break
+        e.add_result(loss)
+    """
+
+    def __init__(self, name, params, num_iter, min_iter=1, eta=3,
+                 comparator=None, **kwargs):
+        super(ASHA, self).__init__(name, params, **kwargs)
+        if comparator is None:
+            comparator = leq
+        self.comparator = comparator
+        self.num_iter = num_iter
+        self.min_iter = min_iter
+        self.eta = eta
+        self.milestones = []
+        milestone = min_iter
+        while milestone < num_iter:
+            self.milestones.append(int(milestone))
+            milestone = milestone * eta
+        self.rungs = Rungs(os.path.join(self.experiment_path, RUNG_FILE),
+                           comparator)
+        self.curr_iter = 0
+
+    def sample_all_params(self):
+        # A new set of parameters starts a new trial.
+        self.curr_iter = 0
+        return super(ASHA, self).sample_all_params()
+
+    def stop(self, validation_result):
+        '''
+        Records the score of the current trial after one more iteration,
+        and returns whether the trial should stop.
+
+        Parameters:
+
+        * validation_result - (float) score of the trial at this iteration.
+
+        Return type: bool
+
+        Example:
+
+            if e.stop(loss):
+                break
+        '''
+        self.curr_iter += 1
+        if self.curr_iter not in self.milestones:
+            return False
+        rung = self.milestones.index(self.curr_iter)
+        count = self.rungs.add(rung, validation_result)
+        return self.rungs.rank(rung, validation_result) >= \
+            int(ceil(count / float(self.eta)))
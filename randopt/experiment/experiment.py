@@ -3,7 +3,7 @@
 import os
 import random
 import json
-import multiprocessing as mp
+import heapq
 
 jsonload = json.load
 
@@ -15,23 +15,100 @@ except ImportError:
 from time import time
 from math import log, ceil
 from collections import namedtuple
+from functools import cmp_to_key
 
-from randopt.samplers import Uniform
-try:  # Try native statistics module
-    from statistics import mean, median, pvariance, pstdev
-except ImportError:
-    from randopt.statistics import mean, median, pvariance, pstdev
+from randopt.samplers import Uniform, np
+from .storage import get_storage, ATTACHMENT_DIR, ATTACHMENT_EXT
+from .query import leq, geq
+from .writer import BufferedWriter
+from .snapshot import Snapshot, SNAPSHOT_FILE
+from .accumulators import Accumulators
+from randopt.statistics import mean, median, pvariance, pstdev
 
 
 """
 This file implements the Experiment, JSONSummary, and SummaryList classes.
 """
 
-ATTACHMENT_DIR = '_attachments'
-ATTACHMENT_EXT = '.pk'
 
-leq = lambda x, y: x.result <= y.result
-geq = lambda x, y: x.result >= y.result
+
+def top_k(candidates, count, fn=leq):
+    """
+    Returns the count best candidates according to fn, best first.
+
+    Keeps a bounded heap whose root is the worst candidate kept so far, so
+    that each new candidate costs a single comparison unless it makes the
+    cut.
+
+    Parameters:
+
+    * candidates - (iterable) objects accepted by fn.
+    * count - (int) number of candidates to return.
+    * fn - (function) comparison function. Default: leq
+
+    Return type: list
+
+    Example:
+
+        best = top_k(exp.all_results(), 10)
+    """
+    if count < 1:
+        return []
+
+    def worse(x, y):
+        return 0 if fn(x, y) else -1
+
+    key = cmp_to_key(worse)
+    heap = []
+    for candidate in candidates:
+        if len(heap) < count:
+            heapq.heappush(heap, key(candidate))
+        elif fn(candidate, heap[0].obj):
+            heapq.heapreplace(heap, key(candidate))
+    heap.sort(reverse=True)
+    return [k.obj for k in heap]
+
+
+class _Candidate(object):
+
+    """
+    Light-weight stand-in for a JSONSummary while results are being ranked.
+
+    Only the result is read upfront, the JSONSummary is built on first
+    access to any other attribute or key.
+    """
+
+    __slots__ = ('result', '_path', '_summary', '_json')
+
+    def __init__(self, directory, name, summary):
+        self.result = summary['result']
+        self._path = (directory, name)
+        self._summary = summary
+        self._json = None
+
+    def summary(self):
+        if self._json is None:
+            fpath = self._path[0] + os.sep + self._path[1] + '.json'
+            self._json = JSONSummary(fpath, self._summary)
+        return self._json
+
+    def __getattr__(self, attr):
+        return getattr(self.summary(), attr)
+
+    def __getitem__(self, key):
+        return self.summary()[key]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _to_int(value):
+    if isinstance(value, list):
+        return [_to_int(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
 
 
 class SummaryList(list):
@@ -39,9 +116,14 @@ class SummaryList(list):
     """
     List of JSON Summaries on steroid.
 
+    When NumPy is available, the values of each key are gathered once into
+    a contiguous array, which aggregations, filter(), sort_by(), and
+    slicing reuse.
+
     Parameters:
 
     * results - (list) list of JSON Summaries.
+    * columns - (dict) keys to arrays of their values in results, if already known. Default: None
 
     Return type: n/a
 
@@ -50,15 +132,19 @@ class SummaryList(list):
         results = exp.top(10)
         results.mean('alpha')
         results.filter(lambda r: r.result > results.mean())
+        results.filter(results.column('alpha') > 0.5)
+        results.sort_by('alpha')
     """
 
-    def __init__(self, results):
+    def __init__(self, results, columns=None):
         list.__init__(self, results)
         self.__results = results
+        self.__columns = dict(columns) if columns is not None else {}
 
     def __getitem__(self, key):
         if isinstance(key, slice):
-            return SummaryList(self.__results[key])
+            # Slices of arrays are views, not copies.
+            return SummaryList(self.__results[key], self._sliced_columns(key))
         return self.__results[key]
 
     def __getslice__(self, i, j):
@@ -67,39 +153,124 @@ class SummaryList(list):
     def __str__(self):
         return 'SummaryList(' + str(len(self)) + ')'
 
+    def _sliced_columns(self, rows):
+        return {key: column[rows]
+                for key, column in self.__columns.items()
+                if column is not None}
+
+    def column(self, key='result'):
+        '''
+        Returns the values of key as a NumPy array, or None if they are not
+        all numbers or lists of numbers of the same length.
+
+        Parameters:
+
+        * key - (string) key of the results. Default: result
+
+        Return type: numpy.ndarray
+
+        Example:
+
+            alphas = results.column('alpha')
+        '''
+        if np is None or len(self) == 0:
+            return None
+        if key not in self.__columns:
+            values = [r.get(key, None) for r in self.__results]
+            column = None
+            if all(_is_number(v) for v in values):
+                column = np.array(values)
+            elif all(isinstance(v, list) for v in values) and \
+                    len(set(len(v) for v in values)) == 1 and \
+                    all(_is_number(x) for x in values[0]):
+                column = np.array(values)
+                if column.dtype.kind not in 'iuf':
+                    column = None
+            self.__columns[key] = column
+        return self.__columns[key]
+
     def count(self):
         return len(self)
 
     def filter(self, fn):
+        if np is not None and isinstance(fn, (np.ndarray, list)):
+            mask = np.asarray(fn, dtype=bool)
+            results = [r for r, m in zip(self, mask.tolist()) if m]
+            return SummaryList(results, self._sliced_columns(mask))
         results = [r for r in self if fn(r)]
         return SummaryList(results)
 
+    def sort_by(self, key='result', reverse=False):
+        '''
+        Returns a SummaryList sorted by the values of key.
+
+        Parameters:
+
+        * key - (string) key of the results. Default: result
+        * reverse - (bool) sort in decreasing order. Default: False
+
+        Return type: SummaryList
+
+        Example:
+
+            results.sort_by('alpha')[:10]
+        '''
+        column = self.column(key)
+        if column is None or column.ndim != 1:
+            results = sorted(self, key=lambda r: r[key], reverse=reverse)
+            return SummaryList(results)
+        order = np.argsort(column, kind='stable')
+        if reverse:
+            order = order[::-1]
+        results = [self.__results[i] for i in order.tolist()]
+        return SummaryList(results, self._sliced_columns(order))
+
     def values(self, key='result'):
         return list({r[key] for r in self})
 
     def map(self, fn, key='result'):
-        if isinstance(self[0][key], list):
-            values = [r[key] for r in self]
+        # Failed trials are recorded with null values, and are skipped.
+        values = [r[key] for r in self if r[key] is not None]
+        if isinstance(values[0], list):
             return [fn(v) for v in zip(*values)]
-        return fn([r[key] for r in self])
+        return fn(values)
+
+    def _reduce(self, key, vectorized, fn, exact=False):
+        column = self.column(key)
+        if column is None:
+            present = [r for r in self if r.get(key, 0) is not None]
+            if len(present) < len(self):
+                return SummaryList(present)._reduce(key, vectorized, fn,
+                                                    exact)
+            return self.map(fn, key)
+        value = vectorized(column, axis=0).tolist()
+        if callable(exact):
+            exact = exact(column)
+        if exact and column.dtype.kind in 'iu':
+            # Like the statistics module, exact statistics of integers are
+            # integers.
+            value = _to_int(value)
+        return value
 
     def min(self, key='result'):
-        return self.map(min, key)
+        return self._reduce(key, np.min if np else None, min)
 
     def max(self, key='result'):
-        return self.map(max, key)
+        return self._reduce(key, np.max if np else None, max)
 
     def mean(self, key='result'):
-        return self.map(mean, key)
+        return self._reduce(key, np.mean if np else None, mean, True)
 
     def variance(self, key='result'):
-        return self.map(pvariance, key)
+        return self._reduce(key, np.var if np else None, pvariance, True)
 
     def std(self, key='result'):
-        return self.map(pstdev, key)
+        return self._reduce(key, np.std if np else None, pstdev)
 
     def median(self, key='result'):
-        return self.map(median, key)
+        # The median of an odd number of values is one of them.
+        return self._reduce(key, np.median if np else None, median,
+                            lambda column: len(column) % 2 == 1)
 
 
 class JSONSummary(dict):
@@ -112,6 +283,7 @@ class JSONSummary(dict):
     Parameters:
     
     * path - (string) path to JSON file.
+    * summary - (dict) content of the JSON file, if already loaded. Default: None
 
     Return type: n/a
 
@@ -123,18 +295,17 @@ class JSONSummary(dict):
         summary.attachment # Attachment is lazy loaded
     """
 
-    def __init__(self, path):
+    def __init__(self, path, summary=None):
         try:
             assert path[-5:] == '.json'
-            with open(path, 'r') as f:
-                result = jsonload(f)
-                for key in result.keys():
-                    self[key] = result[key]
+            if summary is None:
+                with open(path, 'r') as f:
+                    summary = jsonload(f)
+            result = summary
+            self.update(result)
             self.__summary = result
             self.__attachment = None
             self.__path = path
-            self.__dir = os.path.dirname(path)
-            self.__name = os.path.basename(path)[:-5]
         except ValueError:
             raise Exception('Error reading file: ' + path + ' - skipped.')
 
@@ -155,12 +326,14 @@ class JSONSummary(dict):
             raise(NotImplementedError(msg))
 
     def __str__(self):
-        return 'JSONSummary ' + str(self.__name) + ' with value ' + str(self.result)
+        name = os.path.basename(self.__path)[:-5]
+        return 'JSONSummary ' + str(name) + ' with value ' + str(self.result)
 
     def _load_attachment(self):
         if self.__attachment is None:
-            att_path = os.path.join(self.__dir, ATTACHMENT_DIR)
-            att_path = os.path.join(att_path, self.__name + ATTACHMENT_EXT)
+            name = os.path.basename(self.__path)[:-5]
+            att_path = os.path.join(os.path.dirname(self.__path), ATTACHMENT_DIR)
+            att_path = os.path.join(att_path, name + ATTACHMENT_EXT)
             with open(att_path, 'rb') as f:
                 self.__attachment = pk.load(f)
 
@@ -181,6 +354,11 @@ class Experiment(object):
     * name - (string) name of experiment.
     * params - (dict) dicitionary of parameter names to their random sampling functions.
     * directory - (string) directory in which the experiment will be saved. Default: randopt_results
+    * backend - (string) storage backend of the results, 'json', 'log', or 'sqlite'. Default: json
+    * buffered - (bool) write results from a background thread, add_result returns immediately. Default: False
+    * flush_size - (int) number of buffered results written at once. Default: 100
+    * flush_interval - (float) maximum seconds results stay buffered. Default: 1.0
+    * loader - (ResultLoader) pool used to load many result files in parallel. Default: shared loader
 
     Return type: n/a
 
@@ -193,7 +371,9 @@ class Experiment(object):
         })
     '''
 
-    def __init__(self, name, params={}, directory='randopt_results'):
+    def __init__(self, name, params={}, directory='randopt_results',
+                 backend='json', buffered=False, flush_size=100,
+                 flush_interval=1.0, loader=None):
         self.name = name
         self.params = params
         forbidden_keys = ['result', 'attachment', 'name']
@@ -208,6 +388,50 @@ class Experiment(object):
         os.makedirs(randopt_folder, exist_ok=True)
         self.experiment_path = os.path.join(randopt_folder, self.name)
         os.makedirs(self.experiment_path, exist_ok=True)
+        self.storage = get_storage(backend, self.experiment_path, loader)
+        self.storage.recover()
+        self.writer = None
+        if buffered:
+            self.writer = BufferedWriter(self.storage, flush_size,
+                                         flush_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def flush(self):
+        '''
+        Blocks until all buffered results are written.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            e.flush()
+        '''
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        '''
+        Writes buffered results and stops the background writer.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            with ro.Experiment('name', buffered=True) as e:
+                e.add_result(loss)
+        '''
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
     @property
     def current(self):
@@ -217,16 +441,37 @@ class Experiment(object):
         return res
 
     def _search(self, fn=leq):
+        self.flush()
+        best = self.storage.top(1, fn)
+        if best is not None:
+            return self._summary(*best[0]) if len(best) > 0 else None
         result = None
-        for fname in os.listdir(self.experiment_path):
-            base, ext = os.path.splitext(fname)
-            if 'json' in ext:
-                fpath = os.path.join(self.experiment_path, fname)
-                candidate = JSONSummary(fpath)
-                if result is None or fn(candidate, result):
-                    result = candidate
+        for candidate in self._ranked():
+            if result is None or fn(candidate, result):
+                result = candidate
+        if result is not None:
+            result = result.summary()
         return result
 
+    def _candidates(self):
+        self.flush()
+        for name, summary in self.storage.items():
+            yield _Candidate(self.experiment_path, name, summary)
+
+    def _ranked(self):
+        # Failed trials have no result, and are never among the best.
+        for candidate in self._candidates():
+            if candidate.result is not None:
+                yield candidate
+
+    def _summaries(self):
+        for candidate in self._candidates():
+            yield candidate.summary()
+
+    def _summary(self, name, summary):
+        fpath = self.experiment_path + os.sep + name + '.json'
+        return JSONSummary(fpath, summary)
+
     def top(self, count, fn=leq):
         '''
         Returns the top count best results. By default, minimum.
@@ -242,34 +487,12 @@ class Experiment(object):
 
             e.top(3)
         '''
-        top_n_experiments = []
-        for fname in os.listdir(self.experiment_path):
-            base, ext = os.path.splitext(fname)
-            if 'json' in ext:
-                fpath = os.path.join(self.experiment_path, fname)
-
-                summary = JSONSummary(fpath)
-                if len(top_n_experiments) < count:
-                    inserted = False
-                    for i in range(len(top_n_experiments)):
-                        if fn(summary, top_n_experiments[i]):
-                            #place the experiment in place
-                            top_n_experiments.insert(i, summary)
-                            inserted = True
-                            break
-                    if not inserted:
-                        top_n_experiments.append(summary)
-                else:
-                    #iterate over each item in the list
-                    for i in range(count):
-                        if fn(summary, top_n_experiments[i]):
-                            #place the experiment in place
-                            top_n_experiments.insert(i, summary)
-                            #remove the next worst element
-                            top_n_experiments.pop()
-                            break
-
-        return SummaryList(top_n_experiments) 
+        self.flush()
+        best = self.storage.top(count, fn)
+        if best is not None:
+            return SummaryList([self._summary(n, s) for n, s in best])
+        best = top_k(self._ranked(), count, fn)
+        return SummaryList([c.summary() for c in best])
 
     def maximum(self):
         '''
@@ -323,11 +546,92 @@ class Experiment(object):
             summaries = exp.list()
             summaries.filter(lambda x: x.result > 0.1)
         '''
+        snapshot_path = os.path.join(self.experiment_path, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            snapshot = self.snapshot()
+            return SummaryList([self._summary(n, s)
+                                for n, s in snapshot.entries()],
+                               snapshot.arrays())
         return SummaryList(list(self.all()))
 
+    def snapshot(self):
+        '''
+        Creates or updates the columnar snapshot of the results, and returns
+        it. Only the results stored since the last update are read.
+
+        Once a snapshot exists, Experiment.list() is built from it.
+        Requires NumPy.
+
+        Parameters: n/a
+
+        Return type: Snapshot
+
+        Example:
+
+            e.snapshot()
+            e.list().mean()
+        '''
+        self.flush()
+        self.storage.refresh()
+        snapshot_path = os.path.join(self.experiment_path, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            snapshot = Snapshot.load(snapshot_path)
+            entries, marker = self.storage.changes(snapshot.marker)
+            if len(entries) == 0 and marker == snapshot.marker:
+                return snapshot
+            snapshot = snapshot.extend(entries, marker)
+        else:
+            entries, marker = self.storage.changes()
+            snapshot = Snapshot.from_entries(entries, marker)
+        snapshot.save(snapshot_path)
+        return snapshot
+
+    def filter(self, fn):
+        '''
+        Returns a SummaryList of the results satisfying fn.
+
+        Field conditions are run as queries by the backends supporting it,
+        other functions are called on each result.
+
+        Parameters:
+
+        * fn - (function) predicate on JSON summaries, or Field condition.
+
+        Return type: SummaryList
+
+        Example:
+
+            e.filter(ro.Field('alpha') > 0.1)
+            e.filter(lambda r: r.result < 2.0)
+        '''
+        self.flush()
+        entries = self.storage.filter(fn)
+        if entries is not None:
+            return SummaryList([self._summary(n, s) for n, s in entries])
+        return SummaryList([s for s in self._summaries() if fn(s)])
+
+    def stats(self, keys=None, compression=100):
+        '''
+        Returns the statistics of the results, computed in one pass without
+        building a SummaryList.
+
+        Parameters:
+
+        * keys - (list) keys to compute statistics of. Default: all numeric keys
+        * compression - (int) accuracy of the quantile estimates. Default: 100
+
+        Return type: Accumulators
+
+        Example:
+
+            stats = e.stats()
+            stats.mean(), stats.std(), stats.quantile(0.9, 'alpha')
+        '''
+        return Accumulators(keys, compression).update(self.all_results())
+
     def count(self):
         '''
-        Returns the number of JSON summaries.
+        Returns the number of results.
 
         Parameters: n/a
 
@@ -337,13 +641,8 @@ class Experiment(object):
 
             e.count()
         '''
-        file_paths = []
-        for fname in os.listdir(self.experiment_path):
-            base, ext = os.path.splitext(fname)
-            if 'json' in ext:
-                fpath = os.path.join(self.experiment_path, fname)
-                file_paths.append(fpath)
-        return len(file_paths)
+        self.flush()
+        return self.storage.count()
 
 
     def seed(self, seed):
@@ -418,24 +717,113 @@ class Experiment(object):
 
             e.add_result(loss)
         '''
+        fname, res = self._record(result, self.current, data)
+        if self.writer is not None:
+            self.writer.put(fname, res, attachment)
+            return
+        if attachment is not None:
+            self.storage.write_attachments([(fname, attachment)])
+        self.storage.add(fname, res)
+
+    def sample_batch(self, n):
+        '''
+        Generates n randomly sampled values for all specified parameters at
+        once, without changing the current parameters.
+
+        Parameters:
+
+        * n - (int) number of configurations.
+
+        Return type: dict of parameter names to arrays (lists without NumPy).
+
+        Example:
+
+            batch = e.sample_batch(10000)
+            batch['learning_rate'][42]
+        '''
+        return {key: self.params[key].sample_batch(n) for key in self.params}
+
+    def add_results(self, batch, results=None, data=None, attachments=None):
+        '''
+        Saves many results and their attachments in one buffered write.
+
+        Either all results of the call are saved or none of them are, even
+        if the process crashes while writing them.
+
+        The batch is either a columnar dict of parameters (as returned by
+        sample_batch) along with the list of results, or a list of records.
+        Each record is a dict with a 'result' and optional 'params' (default:
+        the current parameters), 'data', and 'attachment' entries.
+
+        Parameters:
+
+        * batch - (dict or list) parameter names to sequences of values, or list of records.
+        * results - (list) value for each configuration of a columnar batch. Default: None
+        * data - (list) additional logging data for each configuration. Default: None
+        * attachments - (list) attachment data for each configuration. Default: None
+
+        Return type: n/a
+
+        Example:
+
+            batch = e.sample_batch(100)
+            e.add_results(batch, [loss(lr) for lr in batch['lr']])
+
+            e.add_results([{'result': 0.1, 'data': {'epoch': 1}},
+                           {'result': 0.2, 'attachment': {'weights': w}}])
+        '''
+        if results is None:
+            records = batch
+        else:
+            records = self._columns_to_records(batch, results, data,
+                                               attachments)
+        entries = []
+        att_entries = []
+        for record in records:
+            params = record.get('params', None)
+            if params is None:
+                params = self.current
+            result = record['result']
+            if hasattr(result, 'tolist'):
+                # NumPy scalars and arrays are not JSON serializable.
+                result = result.tolist()
+            fname, res = self._record(result, params, record.get('data', None))
+            entries.append((fname, res))
+            if record.get('attachment', None) is not None:
+                att_entries.append((fname, record['attachment']))
+        self.flush()
+        self.storage.commit(entries, att_entries)
+
+    def _columns_to_records(self, batch, results, data, attachments):
+        columns = {}
+        for key in batch:
+            column = batch[key]
+            if hasattr(column, 'tolist'):
+                column = column.tolist()
+            if len(column) != len(results):
+                raise ValueError('Batch column ' + key + ' has ' +
+                                 str(len(column)) + ' values for ' +
+                                 str(len(results)) + ' results')
+            columns[key] = column
+        records = []
+        for i, result in enumerate(results):
+            records.append({
+                'result': result,
+                'params': {key: columns[key][i] for key in columns},
+                'data': data[i] if data is not None else None,
+                'attachment': attachments[i] if attachments else None,
+            })
+        return records
+
+    def _record(self, result, params, data=None):
         res = {'result': result}
-        for key in self.params:
-            res[key] = getattr(self, key)
+        for key in params:
+            res[key] = params[key]
         if data is not None:
             for key in data:
                 res[key] = data[key]
         fname = str(time()) + '_' + str(random.random())
-        fpath = os.path.join(self.experiment_path, fname) + '.json'
-        with open(fpath, 'w') as f:
-            json.dump(res, f)
-        if attachment is not None:
-            assert isinstance(attachment, dict)
-            att_path = os.path.join(self.experiment_path, ATTACHMENT_DIR)
-            if not os.path.exists(att_path):
-                os.mkdir(att_path)
-            att_file = os.path.join(att_path, fname + ATTACHMENT_EXT)
-            with open(att_file, 'wb') as f:
-                pk.dump(attachment, f, protocol=-1)
+        return fname, res
 
     def all_results(self):
         '''
@@ -451,24 +839,8 @@ class Experiment(object):
                 print(res.result)
                 print(res.params)
         '''
-
-        file_paths = []
-        for fname in os.listdir(self.experiment_path):
-            base, ext = os.path.splitext(fname)
-            if 'json' in ext:
-                fpath = os.path.join(self.experiment_path, fname)
-                file_paths.append(fpath)
-        if len(file_paths) < 1000:
-            for fpath in file_paths:
-                yield JSONSummary(fpath)
-        else:
-            pool = mp.Pool()
-            chunksize = len(file_paths) // pool._processes
-            summaries = pool.imap_unordered(JSONSummary,
-                                            file_paths,
-                                            chunksize=chunksize)
-            for summary in summaries:
-                yield summary
+        for summary in self._summaries():
+            yield summary
 
     def save_state(self, path):
         '''
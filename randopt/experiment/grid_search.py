@@ -11,9 +11,22 @@ class GridSearch(Experiment):
 
     Only accepts `Choice` as parameter sampler.
 
+    The grid is never built: points are numbered by their position, and
+    only the counts of executed points are stored, so memory grows with
+    the number of results rather than the size of the grid.
+
+    Several workers can split the grid between them: the worker of shard
+    shard_id only samples the points whose position modulo num_shards is
+    shard_id, so that workers never sample the same point.
+
+    Within a worker, a sampled point counts as executed until its result is
+    stored, so that commands running concurrently get different points.
+
     Parameters:
 
     * experiment - (Experiment) Experiment to wrap.
+    * shard_id - (int) shard of the grid sampled by this worker. Default: 0
+    * num_shards - (int) number of shards of the grid. Default: 1
 
     Return type: n/a
 
@@ -21,22 +34,48 @@ class GridSearch(Experiment):
 
         exp = Experiment('name', params={'lr': Choice([1, 2, 3])})
         gs = GridSearch(exp)
+        gs = GridSearch(exp, shard_id=1, num_shards=2)
     """
 
-    def __init__(self, experiment):
+    def __init__(self, experiment, shard_id=0, num_shards=1):
         # Assert that all params are Choice
         for key in experiment.params:
             msg = 'Only Choice samplers accepted'
             assert isinstance(experiment.params[key], Choice), msg
+        msg = 'shard_id should be in [0, num_shards)'
+        assert 0 <= shard_id < num_shards, msg
 
         self.__dict__.update(experiment.__dict__)
         self.experiment = experiment
-        # TODO: Build index of what experiments have been ran
+        # Grid points are numbered in mixed radix over the parameters' items,
+        # the first parameter being the most significant.
+        self.keys = list(self.params)
+        self.values = {}
+        self.positions = {}
+        for key in self.keys:
+            values = []
+            for val in self.params[key].items:
+                if val not in values:
+                    values.append(val)
+            self.values[key] = values
+            self.positions[key] = {val: i for i, val in enumerate(values)}
+        self.strides = {}
+        self.size = 1
+        for key in reversed(self.keys):
+            self.strides[key] = self.size
+            self.size *= len(self.values[key])
+        msg = 'The grid has fewer points than shards'
+        assert shard_id < self.size, msg
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        # Points sampled by this worker whose result is not stored yet.
+        self.leases = {}
+        self._marker = None
         self.refresh_index()
 
     def refresh_index(self):
         """
-        Rebuilds the index of all executed experiments.
+        Rebuilds the counts of all executed experiments.
 
         Parameters: n/a
 
@@ -46,45 +85,78 @@ class GridSearch(Experiment):
 
             gs.refresh_index()
         """
-        index = {}
-        # Build index
-        for key in self.params:
-            self._append_to_index(index, key)
-        self._turn_to_count(index)
-
-        # Count results
-        for e in self.experiment.all_results():
-            experiment_in_grid = True
-            sub_index = index
-            for p in self.params:
-                if e.params[p] in sub_index:
-                    sub_index = sub_index[e.params[p]]
-                else:
-                    experiment_in_grid = False
-                    break
-            if experiment_in_grid:
-                sub_index['count'] += 1
-        self.index = index
-
-    def _turn_to_count(self, index):
-        for val in index:
-            if len(index[val]) == 0:
-                index[val]['count'] = 0
+        if self._marker is not None:
+            # Releases the points whose result was stored since the last call.
+            self._sync()
+        leases, self.leases = self.leases, {}
+        self.counts = {}
+        self._grid = {}
+        self._marker = None
+        self.storage.refresh()
+        # All points of the shard before the cursor were executed more than
+        # min_count times.
+        self._cursor = self.shard_id
+        self._min_count = 0
+        self._sync()
+        self.leases = leases
+        for position, count in self.leases.items():
+            self.counts[position] = self.counts.get(position, 0) + count
+
+    def _sync(self):
+        # Only the results stored since the last call are read, including
+        # those added by other processes, without listing the folder.
+        self.flush()
+        entries, self._marker = self.storage.changes(self._marker)
+        for name, summary in entries:
+            if name in self._grid:
+                # A rewritten result replaces its previous version.
+                self._decrement(self._grid.pop(name))
+            position = self._position(summary)
+            if position is None:
+                continue
+            self._grid[name] = position
+            if position in self.leases:
+                # The point was already counted when it was sampled.
+                self._release(position)
             else:
-                self._turn_to_count(index[val])
-
-    def _append_to_index(self, index, key):
-        if len(index) == 0:
-            for val in self.params[key].items:
-                index[val] = {}
-        else:
-            for sub_key in index:
-                self._append_to_index(index[sub_key], key)
-
+                self.counts[position] = self.counts.get(position, 0) + 1
+
+    def _release(self, position):
+        count = self.leases.pop(position) - 1
+        if count > 0:
+            self.leases[position] = count
+
+    def _decrement(self, position):
+        count = self.counts.pop(position) - 1
+        if count > 0:
+            self.counts[position] = count
+        if count <= self._min_count and \
+                position % self.num_shards == self.shard_id:
+            self._min_count = count
+            self._cursor = min(self._cursor, position)
+
+    def _next_position(self):
+        # Each point is skipped at most once per min_count, and only
+        # executed points are ever skipped.
+        while self.counts.get(self._cursor, 0) > self._min_count:
+            self._cursor += self.num_shards
+            if self._cursor >= self.size:
+                self._cursor = self.shard_id
+                self._min_count += 1
+        return self._cursor
+
+    def _position(self, params):
+        position = 0
+        for key in self.keys:
+            if key not in params or params[key] not in self.positions[key]:
+                return None
+            position += self.positions[key][params[key]] * self.strides[key]
+        return position
 
     def sample(self, key):
         """
         Given current params, choose the experiment that will fill the index.
+        The sampled value is not restricted to the shard of the worker.
 
         Parameters:
 
@@ -95,22 +167,15 @@ class GridSearch(Experiment):
         Example:
 
             gs.sample('x')
-
-        TODO: This function is O(3n), but could be O(n).
         """
-        values = self.params[key].items
-        counts = [0 for _ in values]
-        current = self.current
-        for i, val in enumerate(values):
-            sub_index = self.index
-            for p_key in self.params:
-                if key == p_key:
-                    sub_index = sub_index[val]
-                else:
-                    sub_index = sub_index[current[p_key]]
-            counts[i] = sub_index['count']
-        min_count = min(counts)
-        min_idx = counts.index(min_count)
+        values = self.values[key]
+        current = dict(self.current)
+        current[key] = values[0]
+        base = self._position(current)
+        stride = self.strides[key]
+        counts = [self.counts.get(base + i * stride, 0)
+                  for i in range(len(values))]
+        min_idx = counts.index(min(counts))
         self.set(key, values[min_idx])
         return values[min_idx]
 
@@ -119,34 +184,21 @@ class GridSearch(Experiment):
         Similar to Experiment.sample_all_params()
 
         Returns the first configuration that has been executed less times than
-        the others.
+        the others. The configuration is counted as executed until its result
+        is added.
         """
-        self.refresh_index()
-        min_count = 0
-        while True:
-            for solution in self._possible_solutions(self.index):
-                sub_index = self.index
-                for val in solution:
-                    sub_index = sub_index[val]
-                if sub_index['count'] <= min_count:
-                    for key, val in zip(self.params, solution):
-                        self.set(key, val)
-                    return self.current
-            min_count += 1
-
-    def _possible_solutions(self, index=None, partial=[]):
-        if index is None:
-            index = self.index
-        if 'count' in index and len(index) == 1:
-            yield partial
-        else:
-            for key in index:
-                for sol in self._possible_solutions(index[key], partial + [key, ]):
-                    yield sol
+        self._sync()
+        position = self._next_position()
+        self.leases[position] = self.leases.get(position, 0) + 1
+        self.counts[position] = self.counts.get(position, 0) + 1
+        for key in self.keys:
+            idx, position = divmod(position, self.strides[key])
+            self.set(key, self.values[key][idx])
+        return self.current
 
     def add_result(self, *args, **kwargs):
         """
-        Same as Experiment.add_result but also refreshes the index.
+        Same as Experiment.add_result but also updates the counts.
         """
         super(GridSearch, self).add_result(*args, **kwargs)
-        self.refresh_index()
+        self._sync()
@@ -2,6 +2,7 @@
 
 import os
 import random
+import bisect
 try:
     import ujson as json
 except ImportError:
@@ -11,12 +12,196 @@ try:
 except ImportError:
     import pickle as pk
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from time import time
+from contextlib import contextmanager
 from math import log, ceil
 from collections import namedtuple
 
 from randopt.samplers import Uniform
-from .experiment import Experiment, leq, geq
+from .experiment import Experiment
+from .query import leq, geq, score_key
+from .index import append_lines, read_lines, RACY_INTERVAL
+
+RUN_EXT = '.jsonl'
+RESERVATION_FILE = '_reservations'
+
+
+class Brackets(object):
+
+    """
+    In-memory view of the HyperBand runs recorded in a directory.
+
+    Each run is an append-only log: a first line describing the run, then
+    one line per iteration with its score. On refresh, the directory is
+    listed only if its modification time changed, and only the lines
+    appended to a log since the last refresh are read.
+    The scores of each iteration are kept sorted from best to worst.
+
+    Runs are assigned to brackets through a shared log of reservations,
+    appended while holding a lock so that concurrent workers never see the
+    same counts.
+
+    Parameters:
+
+    * path - (string) path to the directory of runs.
+    * comparator - (function) comparison of results, as for Experiment.top. Default: leq
+
+    Return type: n/a
+
+    Example:
+
+        brackets = Brackets(exp.hyperband_path)
+        brackets.refresh()
+        brackets.count(s=2)
+    """
+
+    def __init__(self, path, comparator=leq):
+        self.path = path
+        self.comparator = comparator
+        self.runs = {}
+        self.scores = {}
+        self._offsets = {}
+        self._counts = {}
+        self._names = []
+        self._mtime = None
+        self._reservations = os.path.join(path, RESERVATION_FILE)
+        self._reserved = 0
+        self._key = score_key(comparator)
+
+    def refresh(self):
+        '''
+        Reads the runs added or updated since the last refresh.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            brackets.refresh()
+        '''
+        self._read_reservations()
+        stat = os.stat(self.path)
+        if stat.st_mtime_ns != self._mtime or \
+                time() - stat.st_mtime < RACY_INTERVAL:
+            self._names = [fname for fname in os.listdir(self.path)
+                           if fname.endswith(RUN_EXT)]
+            self._mtime = stat.st_mtime_ns
+        for fname in self._names:
+            try:
+                stat = os.stat(os.path.join(self.path, fname))
+            except OSError:
+                continue
+            if stat.st_size != self._offsets.get(fname, 0):
+                self._load(fname)
+
+    @contextmanager
+    def lock(self):
+        '''
+        Holds an exclusive lock on the reservations, shared by all processes
+        using the directory. Without fcntl, no lock is taken.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            with brackets.lock():
+                brackets.reserve(run, brackets.count(0))
+        '''
+        with open(self._reservations, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                self._read_reservations()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def reserve(self, run, s):
+        '''
+        Assigns run to bracket s. Should be called while holding lock().
+
+        Parameters:
+
+        * run - (string) file name of the run.
+        * s - (int) bracket of the run.
+
+        Return type: n/a
+
+        Example:
+
+            brackets.reserve(os.path.basename(exp.hb_file), 2)
+        '''
+        append_lines(self._reservations, [json.dumps({'run': run, 's': s})])
+        self._read_reservations()
+
+    def count(self, s):
+        '''
+        Returns the number of runs reserved in bracket s.
+
+        Parameters:
+
+        * s - (int) bracket of the runs.
+
+        Return type: int
+
+        Example:
+
+            brackets.count(2)
+        '''
+        return self._counts.get(s, 0)
+
+    def rank(self, curr_iter, score):
+        '''
+        Returns the number of scores at iteration curr_iter strictly better
+        than score.
+
+        Parameters:
+
+        * curr_iter - (int) iteration of the scores, starting at 1.
+        * score - (float) score to rank.
+
+        Return type: int
+
+        Example:
+
+            brackets.rank(9, 0.5)
+        '''
+        return bisect.bisect_left(self.scores.get(curr_iter, []),
+                                  self._key(score))
+
+    def _load(self, fname):
+        # An incomplete last line, e.g. after a crash, is left unread.
+        lines, self._offsets[fname] = read_lines(
+            os.path.join(self.path, fname), self._offsets.get(fname, 0))
+        for line in lines:
+            entry = json.loads(line.decode('utf-8'))
+            if fname not in self.runs:
+                # The first line describes the run.
+                entry['results'] = []
+                self.runs[fname] = entry
+                continue
+            self.runs[fname]['results'].append(entry['score'])
+            self._insert(entry['iter'], entry['score'])
+
+    def _read_reservations(self):
+        lines, self._reserved = read_lines(self._reservations, self._reserved)
+        for line in lines:
+            s = json.loads(line.decode('utf-8'))['s']
+            self._counts[s] = self._counts.get(s, 0) + 1
+
+    def _insert(self, curr_iter, score):
+        if curr_iter not in self.scores:
+            self.scores[curr_iter] = []
+        bisect.insort(self.scores[curr_iter], self._key(score))
 
 
 class HyperBand(Experiment):
@@ -36,10 +221,17 @@ class HyperBand(Experiment):
         self.comparator = comparator
         self.num_iter = num_iter
         self.hyperband_path = os.path.join(self.experiment_path, 'hyperband')
-        if not os.path.exists(self.hyperband_path):
-            os.mkdir(self.hyperband_path)
+        os.makedirs(self.hyperband_path, exist_ok=True)
+        self.brackets = Brackets(self.hyperband_path, self.comparator)
+        fname = str(time()) + '_' + str(random.random()) + RUN_EXT
+        self.hb_file = os.path.join(self.hyperband_path, fname)
         self.logeta = lambda x: log(x) / log(self.eta)
         self.s_max = int(self.logeta(self.num_iter))
+        # The bracket is reserved when the run starts, so that instances
+        # only reading results do not take part in the schedule.
+        self.s = None
+
+    def _start(self):
         B = (self.s_max + 1) * self.num_iter
         self.s = self._get_s_value()
         self.n = int(ceil(B / self.num_iter / (self.s + 1) * (self.eta**self.s)))
@@ -48,72 +240,48 @@ class HyperBand(Experiment):
         self.i = 0
         self.curr_nconfig = int(self.n * self.eta**(self.i) / self.eta)
         self.next_update = int(self.r * self.eta**(self.i))
-        fname = str(time()) + '_' + str(random.random()) + '.json'
-        self.hb_file = os.path.join(self.hyperband_path, fname)
 
-    def _find_run(self, s=None):
-        res_list = []
-        for fname in os.listdir(self.hyperband_path):
-            base, ext = os.path.splitext(fname)
-            if 'json' in ext:
-                fname = os.path.join(self.hyperband_path, fname)
-                with open(fname, 'r') as f:
-                    res = json.load(f)
-                    if res['s'] == s:
-                        res_list.append(res)
-        return res_list
+    def sample_all_params(self):
+        if self.s is None:
+            self._start()
+        return super(HyperBand, self).sample_all_params()
 
     def _get_s_value(self):
+        # Choosing and reserving the bracket is atomic across workers.
+        with self.brackets.lock():
+            s = self._next_s_value()
+            self.brackets.reserve(os.path.basename(self.hb_file), s)
+        return s
+
+    def _next_s_value(self):
         i = 1
         while True:
             for s in reversed(range(self.s_max + 1)):
             # TOOD: Decide whether to use the following or .
             # for s in range(self.s_max + 1):
-                if len(self._find_run(s=s)) < (s + 1) * i:
+                if self.brackets.count(s) < (s + 1) * i:
                     return s
             i += 1
 
     def _update_hyperband_result(self, score):
-        if not os.path.exists(self.hb_file):
-            open(self.hb_file, 'a').close()
-        with open(self.hb_file, 'r+') as f:
-            if self.curr_iter == 1:
-                res = {
-                        's': self.s,
-                        'n': self.n,
-                        'r': self.r,
-                        'num_iter': self.num_iter,
-                        'i': self.i,
-                        'results': [score, ],
-                        }
-                res.update(self.current)
-            else:
-                res = json.load(f)
-                res['results'].append(score)
-            f.seek(0)
-            json.dump(res, f)
+        lines = []
+        if self.curr_iter == 1:
+            res = {
+                    's': self.s,
+                    'n': self.n,
+                    'r': self.r,
+                    'num_iter': self.num_iter,
+                    'i': self.i,
+                    }
+            res.update(self.current)
+            lines.append(json.dumps(res))
+        lines.append(json.dumps({'iter': self.curr_iter, 'score': score}))
+        append_lines(self.hb_file, lines)
 
     def _continue(self, curr_iter, nb_config, score):
-        # TODO: That is slow.
-        # FIX: Load in memory, check update time of folder.
-        num_seen = 0
-        bound = None
-        for fname in os.listdir(self.hyperband_path):
-            base, ext = os.path.splitext(fname)
-            if 'json' in ext:
-                fname = os.path.join(self.hyperband_path, fname)
-                with open(fname, 'r') as f:
-                    res = json.load(f)
-                    if len(res['results']) >= curr_iter and (
-                            num_seen < nb_config or self.comparator(res['results'][curr_iter-1], bound)):
-                        bound = res['results'][curr_iter-1]
-                        num_seen += 1
-        if num_seen < 1:
-            return True
-        if self.comparator(score, bound):
-            return True
-        return False
-
+        # Continue while among the nb_config best scores seen at curr_iter.
+        self.brackets.refresh()
+        return self.brackets.rank(curr_iter, score) < max(nb_config, 1)
 
     def stop(self, validation_result):
         """
@@ -121,6 +289,8 @@ class HyperBand(Experiment):
                          and so will have to run until the end.
                          Think of a good fix.
         """
+        if self.s is None:
+            self._start()
         self.curr_iter += 1
         stop = False
         if self.curr_iter % self.next_update == 0:
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import atexit
+import multiprocessing as mp
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from time import time
+from multiprocessing.pool import ThreadPool
+
+from collections import OrderedDict
+
+"""
+This file implements the ResultIndex, an on-disk index of JSON summaries,
+and the ResultLoader used to load many summaries in parallel.
+"""
+
+INDEX_FILE = '_index'
+TMP_EXT = '.tmp'
+JOURNAL_DIR = '_journal'
+JOURNAL_EXT = '.pk'
+POOL_THRESHOLD = 1000
+# Directories modified this recently are listed again on refresh, as a new
+# file may share the modification time recorded at the last listing.
+RACY_INTERVAL = 2.0
+# Temporary files untouched for this long, and unlocked, were left by
+# crashed writers.
+ORPHAN_AGE = 60.0
+
+
+def _try_lock(f):
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _remove_orphan(path):
+    try:
+        if time() - os.path.getmtime(path) < ORPHAN_AGE:
+            return
+        with open(path, 'rb') as f:
+            if _try_lock(f):
+                os.remove(path)
+    except (IOError, OSError):
+        # Completed or removed by its writer in the meantime.
+        return
+
+
+def pending_name(fname):
+    """
+    Returns the name of the result written to the temporary file fname, or
+    None if fname is not the temporary file of a result.
+    """
+    if not fname.endswith(TMP_EXT) or '.json.' not in fname:
+        return None
+    return fname[:fname.index('.json.')]
+
+
+def load_summary(path):
+    """
+    Loads the JSON summary stored at path.
+
+    Returns a (name, summary) tuple, where name is the file name without
+    extension. The summary is None if the file could not be parsed.
+    """
+    name = os.path.basename(path)[:-5]
+    try:
+        with open(path, 'r') as f:
+            return name, json.load(f)
+    except ValueError:
+        return name, None
+
+
+def append_lines(path, lines, sync=False):
+    """
+    Appends lines to path with a single write, so that concurrent writers
+    never interleave their lines. If sync is True, the file is also flushed
+    to disk.
+    """
+    data = ''.join(line + '\n' for line in lines).encode('utf-8')
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_lines(path, offset=0):
+    """
+    Returns the complete lines of path after byte offset, and the offset
+    following the last of them. An incomplete last line is left for the
+    next read, as a writer might still be appending it.
+    """
+    if not os.path.exists(path):
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    lines = [line for line in data[:end].splitlines() if len(line) > 0]
+    return lines, offset + end
+
+
+class ResultLoader(object):
+
+    """
+    Loads JSON summaries in parallel once there are at least threshold of
+    them. The pool of workers is created on first use and reused by later
+    loads, until close() is called.
+
+    Summaries are returned in the order of their paths, as (name, summary)
+    tuples of plain dictionaries.
+
+    Parameters:
+
+    * threshold - (int) minimum number of files to load in parallel. Default: 1000
+    * workers - (int) number of workers. Default: number of CPUs
+    * threads - (bool) use threads instead of processes, for I/O-bound file systems. Default: False
+
+    Return type: n/a
+
+    Example:
+
+        loader = ResultLoader(threshold=100, workers=32, threads=True)
+        exp = ro.Experiment('name', loader=loader)
+        ...
+        loader.close()
+    """
+
+    def __init__(self, threshold=POOL_THRESHOLD, workers=None, threads=False):
+        self.threshold = threshold
+        self.workers = workers if workers is not None else mp.cpu_count()
+        self.threads = threads
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.threads:
+                self._pool = ThreadPool(self.workers)
+            else:
+                self._pool = mp.Pool(self.workers)
+            atexit.register(self.close)
+        return self._pool
+
+    def load(self, paths):
+        '''
+        Returns the list of (name, summary) tuples of the given paths.
+
+        Parameters:
+
+        * paths - (list) paths to JSON files.
+
+        Return type: list
+
+        Example:
+
+            loader.load(['exp/0.1_0.2.json', 'exp/0.3_0.4.json'])
+        '''
+        if len(paths) < self.threshold:
+            return [load_summary(p) for p in paths]
+        chunksize = max(1, len(paths) // (4 * self.workers))
+        return list(self.pool.imap(load_summary, paths, chunksize=chunksize))
+
+    def close(self):
+        '''
+        Terminates the workers.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            loader.close()
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            try:
+                atexit.unregister(self.close)
+            except AttributeError:
+                pass
+
+
+DEFAULT_LOADER = ResultLoader()
+
+
+class ResultIndex(object):
+
+    """
+    Append-only index of the JSON summaries of an experiment.
+
+    Each line of the index file holds the name of a result file and its
+    summary (result and params). The index is read incrementally: only
+    lines appended since the last refresh are parsed, and only result files
+    not yet covered by the index are loaded from disk.
+
+    Parameters:
+
+    * path - (string) path to the experiment folder.
+    * loader - (ResultLoader) loader of the files not yet indexed. Default: DEFAULT_LOADER
+
+    Return type: n/a
+
+    Example:
+
+        index = ResultIndex(exp.experiment_path)
+        for name, summary in index.items():
+            print(name, summary['result'])
+    """
+
+    def __init__(self, path, loader=None):
+        self.path = path
+        self.loader = loader if loader is not None else DEFAULT_LOADER
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self.summaries = OrderedDict()
+        self._offset = 0
+        self._mtime = None
+
+    def add(self, name, summary):
+        '''
+        Records the summary of result file name in the index.
+
+        Parameters:
+
+        * name - (string) file name of the result, without extension.
+        * summary - (dict) content of the result file.
+
+        Return type: n/a
+
+        Example:
+
+            index.add(fname, {'result': 0.1, 'alpha': 0.5})
+        '''
+        self.extend([(name, summary)])
+
+    def extend(self, entries):
+        lines = [json.dumps({'file': name, 'summary': summary})
+                 for name, summary in entries]
+        if len(lines) > 0:
+            append_lines(self.index_path, lines)
+
+    def refresh(self):
+        '''
+        Reads new index lines, and indexes result files not yet covered.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            index.refresh()
+        '''
+        self._read_index()
+        self._sync_directory()
+
+    def items(self):
+        self.refresh()
+        return list(self.summaries.items())
+
+    def __len__(self):
+        self.refresh()
+        return len(self.summaries)
+
+    def read(self, offset=0):
+        '''
+        Returns the (name, summary) pairs of the index lines after byte
+        offset, and the offset following them.
+
+        Parameters:
+
+        * offset - (int) position in the index file. Default: 0
+
+        Return type: (list, int)
+
+        Example:
+
+            entries, offset = index.read(offset)
+        '''
+        lines, offset = read_lines(self.index_path, offset)
+        entries = []
+        for line in lines:
+            entry = json.loads(line.decode('utf-8'))
+            entries.append((entry['file'], entry['summary']))
+        return entries, offset
+
+    def _read_index(self):
+        entries, self._offset = self.read(self._offset)
+        for name, summary in entries:
+            self.summaries[name] = summary
+
+    def _remove_orphan(self, fname):
+        # Files of journaled batches are completed by replaying them, and
+        # the others were left by writers that crashed before renaming.
+        batch = fname[fname.index('.json.') + 6:-len(TMP_EXT)]
+        journal = os.path.join(self.path, JOURNAL_DIR, batch)
+        if not os.path.exists(journal + JOURNAL_EXT) and \
+                not os.path.exists(journal + TMP_EXT):
+            _remove_orphan(os.path.join(self.path, fname))
+
+    def _sync_directory(self):
+        # Files are only added, renamed or deleted when the folder changes.
+        stat = os.stat(self.path)
+        if stat.st_mtime_ns == self._mtime and \
+                time() - stat.st_mtime >= RACY_INTERVAL:
+            return
+        self._mtime = stat.st_mtime_ns
+        names = set()
+        pending = set()
+        for fname in os.listdir(self.path):
+            base, ext = os.path.splitext(fname)
+            if 'json' in ext:
+                names.add(base)
+            elif ext == TMP_EXT and pending_name(fname) is not None:
+                pending.add(pending_name(fname))
+                self._remove_orphan(fname)
+        missing = [n for n in names if n not in self.summaries]
+        if len(self.summaries) + len(missing) != len(names):
+            # Some result files were deleted. Indexed results whose file is
+            # still being renamed into place are kept.
+            for name in list(self.summaries.keys()):
+                if name not in names and name not in pending:
+                    del self.summaries[name]
+        if len(missing) == 0:
+            return
+        paths = [os.path.join(self.path, n) + '.json' for n in missing]
+        loaded = self.loader.load(paths)
+        # Partially written files are retried on the next refresh.
+        loaded = [(n, s) for n, s in loaded if s is not None]
+        for name, summary in loaded:
+            self.summaries[name] = summary
+        # Other readers may have indexed the same files in the meantime.
+        entries, self._offset = self.read(self._offset)
+        for name, summary in entries:
+            self.summaries[name] = summary
+        indexed = set(name for name, _ in entries)
+        self.extend([(n, s) for n, s in loaded if n not in indexed])
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import operator
+
+from functools import cmp_to_key
+
+"""
+This file implements the comparators and the Field conditions used to
+query results.
+"""
+
+leq = lambda x, y: x.result <= y.result
+geq = lambda x, y: x.result >= y.result
+
+
+class _Score(object):
+
+    __slots__ = ['result']
+
+    def __init__(self, result):
+        self.result = result
+
+
+def score_key(comparator):
+    """
+    Returns a sort key of raw scores ordering them from best to worst
+    according to comparator, which compares objects with a result.
+    """
+    def compare(x, y):
+        if comparator(_Score(x), _Score(y)):
+            return 0 if comparator(_Score(y), _Score(x)) else -1
+        return 1
+    return cmp_to_key(compare)
+
+
+class Condition(object):
+
+    """
+    Comparison between a key of the results and a value.
+
+    Conditions are callables usable with SummaryList.filter, and backends
+    supporting it translate them to queries. Combine them with & and |.
+
+    Parameters:
+
+    * key - (string) key of the results to compare.
+    * op - (string) one of <, <=, >, >=, ==, !=.
+    * value - (float/int/string) value to compare with.
+
+    Return type: n/a
+
+    Example:
+
+        cond = (Field('alpha') > 0.1) & (Field('result') < 2.0)
+        exp.filter(cond)
+    """
+
+    OPERATORS = {
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge,
+        '==': operator.eq,
+        '!=': operator.ne,
+    }
+
+    def __init__(self, key, op, value):
+        self.key = key
+        self.op = op
+        self.value = value
+
+    def __call__(self, summary):
+        if self.key not in summary:
+            return False
+        try:
+            return self.OPERATORS[self.op](summary[self.key], self.value)
+        except TypeError:
+            return False
+
+    def __and__(self, other):
+        return Conjunction('AND', self, other)
+
+    def __or__(self, other):
+        return Conjunction('OR', self, other)
+
+    def keys(self):
+        return [self.key]
+
+    def sql(self):
+        '''
+        Returns the WHERE clause of the condition and its parameters.
+
+        Example:
+
+            clause, values = cond.sql()
+        '''
+        column = '"' + self.key.replace('"', '""') + '"'
+        op = '=' if self.op == '==' else self.op
+        return column + ' ' + op + ' ?', [self.value]
+
+
+class Conjunction(Condition):
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def __call__(self, summary):
+        if self.op == 'AND':
+            return self.left(summary) and self.right(summary)
+        return self.left(summary) or self.right(summary)
+
+    def keys(self):
+        return self.left.keys() + self.right.keys()
+
+    def sql(self):
+        left, left_values = self.left.sql()
+        right, right_values = self.right.sql()
+        clause = '(' + left + ' ' + self.op + ' ' + right + ')'
+        return clause, left_values + right_values
+
+
+class Field(object):
+
+    """
+    Key of the results, compared to values to create Conditions.
+
+    Parameters:
+
+    * key - (string) key of the results.
+
+    Return type: n/a
+
+    Example:
+
+        results = exp.filter(Field('alpha') <= 0.5)
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, value):
+        return Condition(self.key, '<', value)
+
+    def __le__(self, value):
+        return Condition(self.key, '<=', value)
+
+    def __gt__(self, value):
+        return Condition(self.key, '>', value)
+
+    def __ge__(self, value):
+        return Condition(self.key, '>=', value)
+
+    def __eq__(self, value):
+        return Condition(self.key, '==', value)
+
+    def __ne__(self, value):
+        return Condition(self.key, '!=', value)
+
+    __hash__ = object.__hash__
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import tempfile
+import numbers
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+This file implements the Snapshot, a columnar copy of the results of an
+experiment saved as a NumPy .npz file.
+"""
+
+SNAPSHOT_FILE = '_snapshot.npz'
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+class Column(object):
+
+    """
+    Values of one key of the results.
+
+    Numeric columns hold a float64 array of values, other columns hold
+    indices in a table of JSON-encoded values. The mask tells which results
+    have the key.
+    """
+
+    def __init__(self, mask, values=None, codes=None, table=None,
+                 integer=False):
+        self.mask = mask
+        self.values = values
+        self.codes = codes
+        self.table = table
+        self.integer = integer
+
+    @property
+    def numeric(self):
+        return self.values is not None
+
+    @classmethod
+    def from_values(cls, values):
+        mask = np.array([v is not _MISSING for v in values], dtype=bool)
+        present = [v for v in values if v is not _MISSING]
+        if all(_is_number(v) for v in present):
+            array = np.array([v if v is not _MISSING else np.nan
+                              for v in values], dtype=np.float64)
+            integer = all(isinstance(v, numbers.Integral) for v in present)
+            return cls(mask, values=array, integer=integer)
+        encoded = [json.dumps(v) if v is not _MISSING else None
+                   for v in values]
+        table = sorted(set(e for e in encoded if e is not None))
+        positions = {e: i for i, e in enumerate(table)}
+        codes = np.array([positions[e] if e is not None else -1
+                          for e in encoded], dtype=np.int32)
+        return cls(mask, codes=codes, table=np.array(table, dtype=str))
+
+    def __len__(self):
+        return len(self.mask)
+
+    def decode(self):
+        '''
+        Returns the list of Python values of the column, with _MISSING for
+        results without the key.
+        '''
+        if self.numeric:
+            if self.integer:
+                values = np.where(self.mask, self.values, 0)
+                values = values.astype(np.int64).tolist()
+            else:
+                values = self.values.tolist()
+        else:
+            table = [json.loads(e) for e in self.table.tolist()]
+            values = [table[c] if c >= 0 else None
+                      for c in self.codes.tolist()]
+        return [v if m else _MISSING
+                for v, m in zip(values, self.mask.tolist())]
+
+    def take(self, rows):
+        if self.numeric:
+            return Column(self.mask[rows], values=self.values[rows],
+                          integer=self.integer)
+        return Column(self.mask[rows], codes=self.codes[rows],
+                      table=self.table)
+
+    @staticmethod
+    def concatenate(first, second):
+        if first.numeric and second.numeric:
+            return Column(np.concatenate([first.mask, second.mask]),
+                          values=np.concatenate([first.values,
+                                                 second.values]),
+                          integer=first.integer and second.integer)
+        return Column.from_values(first.decode() + second.decode())
+
+
+class _Missing(object):
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+_MISSING = _Missing()
+
+
+class Snapshot(object):
+
+    """
+    Columnar copy of the results of an experiment.
+
+    Each key of the results is stored as one array, so that loading a
+    snapshot does not parse any JSON file. The snapshot remembers the
+    storage marker it is up to date with, and is updated with the results
+    stored since.
+
+    Parameters:
+
+    * names - (numpy.ndarray) names of the results.
+    * columns - (dict) keys of the results to their Column.
+    * marker - (object) storage marker of the snapshot. Default: None
+
+    Return type: n/a
+
+    Example:
+
+        snapshot = exp.snapshot()
+        snapshot.columns['result'].values.mean()
+    """
+
+    def __init__(self, names, columns, marker=None):
+        self.names = names
+        self.columns = columns
+        self.marker = marker
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_entries(cls, entries, marker=None):
+        '''
+        Builds a snapshot from (name, summary) pairs.
+
+        Parameters:
+
+        * entries - (list) (name, summary) pairs.
+        * marker - (object) storage marker of the entries. Default: None
+
+        Return type: Snapshot
+
+        Example:
+
+            Snapshot.from_entries(exp.storage.items())
+        '''
+        if np is None:
+            raise ImportError('Snapshots require NumPy.')
+        # Later entries replace earlier ones with the same name.
+        unique = {}
+        for name, summary in entries:
+            unique.pop(name, None)
+            unique[name] = summary
+        names = np.array(list(unique.keys()), dtype=str)
+        summaries = list(unique.values())
+        keys = []
+        for summary in summaries:
+            for key in summary:
+                if key not in keys:
+                    keys.append(key)
+        columns = {}
+        for key in keys:
+            values = [s.get(key, _MISSING) for s in summaries]
+            columns[key] = Column.from_values(values)
+        return cls(names, columns, marker)
+
+    def extend(self, entries, marker=None):
+        '''
+        Returns a snapshot with the given entries added. Entries whose name
+        is already in the snapshot replace the existing rows.
+
+        Parameters:
+
+        * entries - (list) (name, summary) pairs.
+        * marker - (object) storage marker of the new snapshot. Default: None
+
+        Return type: Snapshot
+
+        Example:
+
+            entries, marker = exp.storage.changes(snapshot.marker)
+            snapshot = snapshot.extend(entries, marker)
+        '''
+        new = Snapshot.from_entries(entries, marker)
+        if len(new) == 0:
+            return Snapshot(self.names, self.columns, marker)
+        keep = ~np.isin(self.names, new.names)
+        names = np.concatenate([self.names[keep], new.names])
+        columns = {}
+        for key in list(self.columns) + list(new.columns):
+            if key in columns:
+                continue
+            old = self._column(key, len(self)).take(keep)
+            columns[key] = Column.concatenate(old, new._column(key, len(new)))
+        return Snapshot(names, columns, marker)
+
+    def _column(self, key, length):
+        if key in self.columns:
+            return self.columns[key]
+        return Column(np.zeros(length, dtype=bool),
+                      values=np.full(length, np.nan), integer=True)
+
+    def entries(self):
+        '''
+        Returns the list of (name, summary) pairs of the snapshot.
+
+        Parameters: n/a
+
+        Return type: list
+
+        Example:
+
+            for name, summary in snapshot.entries():
+                print(summary['result'])
+        '''
+        keys = list(self.columns.keys())
+        decoded = [self.columns[key].decode() for key in keys]
+        entries = []
+        for i, name in enumerate(self.names.tolist()):
+            summary = {}
+            for key, values in zip(keys, decoded):
+                if values[i] is not _MISSING:
+                    summary[key] = values[i]
+            entries.append((name, summary))
+        return entries
+
+    def arrays(self):
+        '''
+        Returns the keys present in all results with numeric values, mapped
+        to arrays of their values.
+
+        Parameters: n/a
+
+        Return type: dict
+
+        Example:
+
+            snapshot.arrays()['result'].mean()
+        '''
+        arrays = {}
+        for key, column in self.columns.items():
+            if column.numeric and column.mask.all():
+                values = column.values
+                if column.integer:
+                    values = values.astype(np.int64)
+                arrays[key] = values
+        return arrays
+
+    def save(self, path):
+        '''
+        Saves the snapshot to path. The file is replaced atomically, so that
+        concurrent readers always load a complete snapshot.
+
+        Parameters:
+
+        * path - (string) path to the .npz file.
+
+        Return type: n/a
+
+        Example:
+
+            snapshot.save(os.path.join(exp.experiment_path, SNAPSHOT_FILE))
+        '''
+        arrays = {'names': self.names}
+        meta = {'marker': self.marker, 'keys': [], 'integer': []}
+        for i, key in enumerate(self.columns):
+            column = self.columns[key]
+            meta['keys'].append(key)
+            meta['integer'].append(column.integer)
+            arrays['mask_' + str(i)] = column.mask
+            if column.numeric:
+                arrays['values_' + str(i)] = column.values
+            else:
+                arrays['codes_' + str(i)] = column.codes
+                arrays['table_' + str(i)] = column.table
+        arrays['meta'] = np.array(json.dumps(meta))
+        # Concurrent writers each rename their own complete file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads the snapshot saved at path.
+
+        Parameters:
+
+        * path - (string) path to the .npz file.
+
+        Return type: Snapshot
+
+        Example:
+
+            snapshot = Snapshot.load(path)
+        '''
+        if np is None:
+            raise ImportError('Snapshots require NumPy.')
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            columns = {}
+            for i, key in enumerate(meta['keys']):
+                i = str(i)
+                if 'values_' + i in data:
+                    columns[key] = Column(data['mask_' + i],
+                                          values=data['values_' + i],
+                                          integer=meta['integer'][int(i)])
+                else:
+                    columns[key] = Column(data['mask_' + i],
+                                          codes=data['codes_' + i],
+                                          table=data['table_' + i])
+            return cls(data['names'], columns, meta['marker'])
@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import numbers
+import shutil
+import random
+import sqlite3
+import threading
+
+try:
+    import cPickle as pk
+except ImportError:
+    import pickle as pk
+
+from time import time
+
+from .index import ResultIndex, INDEX_FILE, TMP_EXT, JOURNAL_DIR, \
+    JOURNAL_EXT, append_lines, read_lines, _try_lock, _remove_orphan
+from .query import Condition, leq, geq
+
+"""
+This file implements the storage backends of Experiment results.
+
+A backend stores (name, summary) pairs, where name identifies the result
+(and its attachment) and summary is the dictionary written by add_result.
+"""
+
+ATTACHMENT_DIR = '_attachments'
+ATTACHMENT_EXT = '.pk'
+SEGMENT_DIR = '_segments'
+SEGMENT_EXT = '.jsonl'
+SEGMENT_SIZE = 64 * 1024 * 1024
+DATABASE_FILE = '_results.db'
+
+
+def write_attachment(path, name, attachment):
+    """
+    Pickles the attachment of result name in the experiment folder path.
+    """
+    assert isinstance(attachment, dict)
+    att_path = os.path.join(path, ATTACHMENT_DIR)
+    os.makedirs(att_path, exist_ok=True)
+    att_file = os.path.join(att_path, name + ATTACHMENT_EXT)
+    with open(att_file, 'wb') as f:
+        pk.dump(attachment, f, protocol=-1)
+
+
+class Storage(object):
+
+    """
+    Base class for all storage backends.
+
+    Note: This class should not be directly instanciated.
+    """
+
+    def __init__(self, path, loader=None):
+        self.path = path
+        self.loader = loader
+
+    def add(self, name, summary):
+        self.extend([(name, summary)])
+
+    def extend(self, entries):
+        raise NotImplementedError('extend() has not been implemented.')
+
+    def items(self):
+        raise NotImplementedError('items() has not been implemented.')
+
+    def count(self):
+        return sum(1 for _ in self.items())
+
+    def clear(self):
+        raise NotImplementedError('clear() has not been implemented.')
+
+    def write_attachments(self, attachments):
+        for name, attachment in attachments:
+            write_attachment(self.path, name, attachment)
+
+    def commit(self, entries, attachments=()):
+        '''
+        Stores a batch of entries and their attachments, such that either
+        all of them or none of them are stored if the writer crashes.
+
+        The batch is first written to a journal file, flushed to disk once,
+        and then applied. Batches whose writer crashed while applying them
+        are completed by recover().
+
+        Parameters:
+
+        * entries - (list) (name, summary) pairs.
+        * attachments - (list) (name, attachment) pairs. Default: ()
+
+        Return type: n/a
+
+        Example:
+
+            storage.commit([(name, {'result': 0.1})], [(name, {'w': w})])
+        '''
+        journal_path = os.path.join(self.path, JOURNAL_DIR)
+        os.makedirs(journal_path, exist_ok=True)
+        fname = str(time()) + '_' + str(random.random())
+        tmp_path = os.path.join(journal_path, fname + TMP_EXT)
+        committed = os.path.join(journal_path, fname + JOURNAL_EXT)
+        with open(tmp_path, 'wb') as f:
+            # Hold the lock so that recover() leaves this batch alone.
+            _try_lock(f)
+            pk.dump((entries, attachments), f, protocol=-1)
+            f.flush()
+            os.fsync(f.fileno())
+            os.rename(tmp_path, committed)
+            self._apply(entries, attachments, fname)
+            os.remove(committed)
+
+    def _apply(self, entries, attachments, batch):
+        # Attachments first, so that visible results have their attachment.
+        self.write_attachments(attachments)
+        self.extend(entries)
+
+    def recover(self):
+        '''
+        Completes the journaled batches of writers that crashed, and removes
+        their uncommitted journals. Only the journal folder is listed.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            storage.recover()
+        '''
+        journal_path = os.path.join(self.path, JOURNAL_DIR)
+        if not os.path.exists(journal_path):
+            return
+        for fname in os.listdir(journal_path):
+            fpath = os.path.join(journal_path, fname)
+            if fname.endswith(TMP_EXT):
+                # The writer crashed before committing its batch.
+                _remove_orphan(fpath)
+            if not fname.endswith(JOURNAL_EXT):
+                continue
+            try:
+                with open(fpath, 'rb') as f:
+                    if not _try_lock(f) or not os.path.exists(fpath):
+                        continue
+                    entries, attachments = pk.load(f)
+                    self._apply(entries, attachments,
+                                fname[:-len(JOURNAL_EXT)])
+                    os.remove(fpath)
+            except (IOError, OSError, EOFError):
+                # Another process completed or removed it first.
+                continue
+
+    def refresh(self):
+        '''
+        Picks up the results written to the folder without going through
+        the storage, so that changes() includes them.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            storage.refresh()
+            entries, marker = storage.changes()
+        '''
+        return
+
+    def changes(self, marker=None):
+        '''
+        Returns the (name, summary) pairs stored since marker, and the marker
+        of the current state. A None marker returns all results.
+
+        Results rewritten under an existing name are returned again, and
+        later pairs replace earlier ones.
+
+        Parameters:
+
+        * marker - (object) JSON-serializable marker returned by a previous call. Default: None
+
+        Return type: (list, object)
+
+        Example:
+
+            entries, marker = storage.changes()
+            new_entries, marker = storage.changes(marker)
+        '''
+        raise NotImplementedError('changes() has not been implemented.')
+
+    def top(self, count, fn):
+        '''
+        Returns the count best (name, summary) pairs according to fn, or
+        None if the backend cannot answer the query natively.
+        '''
+        return None
+
+    def filter(self, fn):
+        '''
+        Returns the (name, summary) pairs satisfying fn, or None if the
+        backend cannot answer the query natively.
+        '''
+        return None
+
+
+class JSONStorage(Storage):
+
+    """
+    Stores each result in its own JSON file, and keeps a ResultIndex of
+    them for fast queries. This is the default backend.
+
+    Parameters:
+
+    * path - (string) path to the experiment folder.
+    * loader - (ResultLoader) loader of the files not yet indexed. Default: None
+
+    Return type: n/a
+
+    Example:
+
+        exp = ro.Experiment('name', backend='json')
+    """
+
+    def __init__(self, path, loader=None):
+        super(JSONStorage, self).__init__(path, loader)
+        self.index = ResultIndex(path, loader)
+
+    def extend(self, entries):
+        self._write(entries, str(time()) + '_' + str(random.random()))
+
+    def _apply(self, entries, attachments, batch):
+        self.write_attachments(attachments)
+        self._write(entries, batch)
+
+    def _write(self, entries, batch):
+        # Files are written under temporary names, which readers ignore, and
+        # all results become visible at once with the index lines. Renaming
+        # them into place completes the batch.
+        entries = list(entries)
+        renames = []
+        for name, summary in entries:
+            fpath = os.path.join(self.path, name) + '.json'
+            tmp_path = fpath + '.' + batch + TMP_EXT
+            with open(tmp_path, 'w') as f:
+                json.dump(summary, f)
+            renames.append((tmp_path, fpath))
+        self.index.extend(entries)
+        for tmp_path, fpath in renames:
+            os.rename(tmp_path, fpath)
+
+    def items(self):
+        return self.index.items()
+
+    def count(self):
+        return len(self.index)
+
+    def changes(self, marker=None):
+        # The marker is the index offset. Older markers also held the number
+        # of result files.
+        if isinstance(marker, list):
+            marker = marker[0]
+        # Results written without the index are only included once indexed
+        # by refresh(), so that no call lists the folder.
+        return self.index.read(marker if marker is not None else 0)
+
+    def refresh(self):
+        self.index.refresh()
+
+    def clear(self):
+        for fname in os.listdir(self.path):
+            base, ext = os.path.splitext(fname)
+            if 'json' in ext or fname == INDEX_FILE:
+                os.remove(os.path.join(self.path, fname))
+        self.index = ResultIndex(self.path, self.loader)
+
+
+class LogStorage(Storage):
+
+    """
+    Appends results as JSON lines to a segment file owned by the writing
+    process. Segments are rotated once they exceed segment_size bytes, and
+    are read by streaming.
+
+    Parameters:
+
+    * path - (string) path to the experiment folder.
+    * segment_size - (int) size in bytes after which segments are rotated. Default: 64MB
+
+    Return type: n/a
+
+    Example:
+
+        exp = ro.Experiment('name', backend='log')
+    """
+
+    def __init__(self, path, loader=None, segment_size=SEGMENT_SIZE):
+        super(LogStorage, self).__init__(path, loader)
+        self.segment_size = segment_size
+        self.segment_path = os.path.join(path, SEGMENT_DIR)
+        os.makedirs(self.segment_path, exist_ok=True)
+        self._segment = None
+        self._pid = None
+        self._counts = {}
+
+    def _writable_segment(self):
+        if self._segment is None or self._pid != os.getpid() or \
+                os.path.getsize(self._segment) >= self.segment_size:
+            self._pid = os.getpid()
+            fname = str(self._pid) + '_' + str(time()) + '_' + \
+                str(random.random()) + SEGMENT_EXT
+            self._segment = os.path.join(self.segment_path, fname)
+            open(self._segment, 'a').close()
+        return self._segment
+
+    def _segments(self):
+        if not os.path.exists(self.segment_path):
+            return []
+        return [os.path.join(self.segment_path, fname)
+                for fname in sorted(os.listdir(self.segment_path))
+                if fname.endswith(SEGMENT_EXT)]
+
+    def extend(self, entries):
+        lines = [json.dumps({'file': name, 'summary': summary})
+                 for name, summary in entries]
+        if len(lines) > 0:
+            append_lines(self._writable_segment(), lines)
+
+    def commit(self, entries, attachments=()):
+        # A batch is a single line, which readers skip until it is complete.
+        self.write_attachments(attachments)
+        batch = [{'file': name, 'summary': summary}
+                 for name, summary in entries]
+        append_lines(self._writable_segment(), [json.dumps({'batch': batch})],
+                     sync=True)
+
+    @staticmethod
+    def _entries(line):
+        entry = json.loads(line.decode('utf-8'))
+        if 'batch' in entry:
+            return [(e['file'], e['summary']) for e in entry['batch']]
+        return [(entry['file'], entry['summary'])]
+
+    def items(self):
+        for segment in self._segments():
+            with open(segment, 'rb') as f:
+                for line in f:
+                    # A line without newline is still being written.
+                    if line.endswith(b'\n'):
+                        for entry in self._entries(line):
+                            yield entry
+
+    def count(self):
+        total = 0
+        for segment in self._segments():
+            offset, num = self._counts.get(segment, (0, 0))
+            lines, offset = read_lines(segment, offset)
+            for line in lines:
+                num += len(self._entries(line))
+            self._counts[segment] = (offset, num)
+            total += num
+        return total
+
+    def changes(self, marker=None):
+        marker = dict(marker or {})
+        entries = []
+        for segment in self._segments():
+            fname = os.path.basename(segment)
+            lines, marker[fname] = read_lines(segment, marker.get(fname, 0))
+            for line in lines:
+                entries.extend(self._entries(line))
+        return entries, marker
+
+    def clear(self):
+        shutil.rmtree(self.segment_path, ignore_errors=True)
+        os.makedirs(self.segment_path, exist_ok=True)
+        self._segment = None
+        self._counts = {}
+
+
+class SQLiteStorage(Storage):
+
+    """
+    Stores results in a SQLite database, with one indexed column per
+    scalar key of the summaries. minimum, maximum, top, count, and filter
+    on Field conditions run as SQL queries. The database uses WAL mode so
+    that concurrent workers can write while others read.
+
+    Parameters:
+
+    * path - (string) path to the experiment folder.
+
+    Return type: n/a
+
+    Example:
+
+        exp = ro.Experiment('name', backend='sqlite')
+        exp.filter(ro.Field('alpha') < 0.1)
+    """
+
+    def __init__(self, path, loader=None):
+        super(SQLiteStorage, self).__init__(path, loader)
+        self.db_path = os.path.join(path, DATABASE_FILE)
+        self._lock = threading.RLock()
+        self._pid = None
+        self._columns = {}
+
+    @property
+    def connection(self):
+        # Connections can not be shared with forked processes.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._connection = sqlite3.connect(self.db_path, timeout=60.0,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                     '_name TEXT PRIMARY KEY, '
+                                     '_summary TEXT NOT NULL, '
+                                     'result REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS '
+                                     '_index_result ON results (result)')
+            self._connection.commit()
+            self._read_columns()
+        return self._connection
+
+    @staticmethod
+    def _fold(key):
+        # SQLite column names are case-insensitive for ASCII letters only.
+        return ''.join(c.lower() if c < '\x80' else c for c in key)
+
+    def _has_column(self, key):
+        # Keys differing from a column only by case stay in _summary.
+        return self._columns.get(self._fold(key), None) == key
+
+    def _read_columns(self):
+        rows = self._connection.execute('PRAGMA table_info(results)')
+        self._columns = {self._fold(row[1]): row[1] for row in rows}
+
+    def _add_column(self, key):
+        column = '"' + key.replace('"', '""') + '"'
+        index = '"_index_' + key.replace('"', '""') + '"'
+        try:
+            self.connection.execute('ALTER TABLE results ADD COLUMN ' + column)
+            self.connection.execute('CREATE INDEX IF NOT EXISTS ' + index +
+                                    ' ON results (' + column + ')')
+        except sqlite3.OperationalError:
+            # Another worker added it concurrently.
+            self._read_columns()
+            if self._fold(key) not in self._columns:
+                raise
+            return
+        self._columns[self._fold(key)] = key
+
+    @staticmethod
+    def _is_scalar(value):
+        return isinstance(value, (numbers.Number, str)) and \
+            not isinstance(value, complex)
+
+    def extend(self, entries):
+        entries = list(entries)
+        with self._lock:
+            connection = self.connection
+            for name, summary in entries:
+                for key, value in summary.items():
+                    if self._fold(key) not in self._columns and \
+                            not key.startswith('_') and self._is_scalar(value):
+                        self._add_column(key)
+            with connection:
+                for name, summary in entries:
+                    keys = ['_name', '_summary']
+                    values = [name, json.dumps(summary)]
+                    for key, value in summary.items():
+                        if not key.startswith('_') and \
+                                self._has_column(key) and self._is_scalar(value):
+                            keys.append(key)
+                            values.append(value)
+                    columns = ', '.join('"' + k.replace('"', '""') + '"'
+                                        for k in keys)
+                    marks = ', '.join('?' for _ in keys)
+                    connection.execute('INSERT OR REPLACE INTO results (' +
+                                       columns + ') VALUES (' + marks + ')',
+                                       values)
+
+    def commit(self, entries, attachments=()):
+        # extend() writes all entries in a single transaction.
+        self.write_attachments(attachments)
+        self.extend(entries)
+
+    def _select(self, query, values=()):
+        with self._lock:
+            cursor = self.connection.execute(query, values)
+            rows = cursor.fetchall()
+        return [(name, json.loads(summary)) for name, summary in rows]
+
+    def items(self):
+        return self._select('SELECT _name, _summary FROM results')
+
+    def count(self):
+        with self._lock:
+            cursor = self.connection.execute('SELECT COUNT(*) FROM results')
+            return cursor.fetchone()[0]
+
+    def changes(self, marker=None):
+        with self._lock:
+            cursor = self.connection.execute('SELECT rowid, _name, _summary '
+                                             'FROM results WHERE rowid > ? '
+                                             'ORDER BY rowid', (marker or 0, ))
+            rows = cursor.fetchall()
+        if len(rows) > 0:
+            marker = rows[-1][0]
+        entries = [(name, json.loads(summary)) for _, name, summary in rows]
+        return entries, marker
+
+    def clear(self):
+        with self._lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM results')
+
+    def top(self, count, fn):
+        if fn is leq:
+            order = 'ASC'
+        elif fn is geq:
+            order = 'DESC'
+        else:
+            return None
+        with self._lock:
+            # Non-scalar results can only be ranked by fn. Results of failed
+            # trials are null, and are not ranked.
+            try:
+                cursor = self.connection.execute(
+                    'SELECT 1 FROM results WHERE result IS NULL AND '
+                    'json_type(_summary, \'$.result\') != \'null\' LIMIT 1')
+            except sqlite3.OperationalError:
+                # SQLite was built without JSON functions.
+                return None
+            if cursor.fetchone() is not None:
+                return None
+        return self._select('SELECT _name, _summary FROM results '
+                            'WHERE result IS NOT NULL ORDER BY result ' +
+                            order + ' LIMIT ?', (count, ))
+
+    def filter(self, fn):
+        if not isinstance(fn, Condition):
+            return None
+        with self._lock:
+            self.connection
+            if not all(self._has_column(k) for k in fn.keys()):
+                self._read_columns()
+            if not all(self._has_column(k) for k in fn.keys()):
+                # Non-scalar or missing keys can only be checked by fn.
+                return None
+        clause, values = fn.sql()
+        if not all(self._is_scalar(v) for v in values):
+            return None
+        return self._select('SELECT _name, _summary FROM results WHERE ' +
+                            clause, values)
+
+
+BACKENDS = {
+    'json': JSONStorage,
+    'log': LogStorage,
+    'sqlite': SQLiteStorage,
+}
+
+
+def get_storage(backend, path, loader=None):
+    """
+    Instanciates the storage backend for the experiment folder path.
+
+    Parameters:
+
+    * backend - (string or class) name of the backend, or a Storage subclass.
+    * path - (string) path to the experiment folder.
+    * loader - (ResultLoader) loader of result files. Default: None
+
+    Return type: Storage
+
+    Example:
+
+        storage = get_storage('log', exp.experiment_path)
+    """
+    if isinstance(backend, str):
+        if backend not in BACKENDS:
+            raise ValueError('Backend must be one of [' +
+                             ' '.join(sorted(BACKENDS)) + ']')
+        backend = BACKENDS[backend]
+    return backend(path, loader)
+
+
+def migrate(path, source='json', destination='log', remove=False):
+    """
+    Copies all results of an experiment folder from one backend to another.
+    Attachments are shared by all backends and are left in place.
+
+    Parameters:
+
+    * path - (string) path to the experiment folder.
+    * source - (string) backend to read from. Default: json
+    * destination - (string) backend to write to. Default: log
+    * remove - (bool) remove the results from the source backend. Default: False
+
+    Return type: (int) number of migrated results.
+
+    Example:
+
+        migrate('randopt_results/exp_name', 'json', 'log')
+    """
+    src = get_storage(source, path)
+    dst = get_storage(destination, path)
+    entries = list(src.items())
+    dst.extend(entries)
+    if remove:
+        src.clear()
+    return len(entries)
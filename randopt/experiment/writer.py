@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import atexit
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from time import time
+
+"""
+This file implements the BufferedWriter, which saves results of an
+Experiment from a background thread.
+"""
+
+
+class BufferedWriter(object):
+
+    """
+    Queues results and writes them to a storage backend from a background
+    thread, in batches of flush_size results or every flush_interval
+    seconds, whichever comes first. Pending results are written when
+    flush() or close() are called, and when the interpreter exits.
+
+    Parameters:
+
+    * storage - (Storage) backend to write to.
+    * flush_size - (int) number of results after which a batch is written. Default: 100
+    * flush_interval - (float) seconds after which a batch is written. Default: 1.0
+
+    Return type: n/a
+
+    Example:
+
+        writer = BufferedWriter(exp.storage, flush_size=1000)
+        writer.put(name, {'result': 0.1})
+        writer.close()
+    """
+
+    def __init__(self, storage, flush_size=100, flush_interval=1.0):
+        self.storage = storage
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, name, summary, attachment=None):
+        '''
+        Queues a result for writing, and returns immediately.
+
+        Parameters:
+
+        * name - (string) name of the result.
+        * summary - (dict) summary of the result.
+        * attachment - (dict) attachment of the result. Default: None
+
+        Return type: n/a
+
+        Example:
+
+            writer.put(name, {'result': 0.1})
+        '''
+        self._check()
+        if self._closed:
+            raise ValueError('Can not write results to a closed writer.')
+        self._queue.put((name, summary, attachment))
+
+    def flush(self):
+        '''
+        Blocks until all queued results are written.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            writer.flush()
+        '''
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+        self._check()
+
+    def close(self):
+        '''
+        Writes queued results and stops the background thread.
+
+        Parameters: n/a
+
+        Return type: n/a
+
+        Example:
+
+            writer.close()
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            atexit.unregister(self.close)
+        except AttributeError:
+            pass
+        self._check()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if isinstance(item, tuple):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time() + self.flush_interval
+                if len(batch) < self.flush_size:
+                    continue
+            self._write(batch)
+            batch = []
+            deadline = None
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _write(self, batch):
+        if len(batch) == 0:
+            return
+        entries = [(name, summary) for name, summary, _ in batch]
+        attachments = [(name, attachment)
+                       for name, _, attachment in batch
+                       if attachment is not None]
+        try:
+            self.storage.commit(entries, attachments)
+        except Exception as error:
+            # Raised in the caller's thread on the next put/flush/close.
+            self._error = error
@@ -5,10 +5,7 @@ This module defines scalarization functions for multi-objective
 optimization problems.
 """
 
-try:  # Try native statistics module
-    from statistics import mean, median, pvariance, pstdev
-except ImportError:
-    from randopt.statistics import mean, median, pvariance, pstdev
+from randopt.statistics import mean, median, pvariance, pstdev
 
 variance = pvariance
 std = pstdev
@@ -3,6 +3,11 @@
 import random
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from . import RANDOPT_RNG
 
 """
@@ -26,6 +31,39 @@ class Sampler(object):
     def sample(self):
         raise NotImplementedError('sample() has not been implemented.')
 
+    def sample_batch(self, n):
+        """
+        Returns n samples at once, as a NumPy array.
+
+        The samples are drawn from a NumPy generator seeded by the sampler's
+        own random state, so that seed() and set_state() also reproduce
+        batches. Without NumPy, returns a list of n calls to sample().
+
+        Parameters:
+
+        * n - (int) number of samples.
+
+        Return type: numpy.ndarray or list
+
+        Example:
+
+            randopt.Uniform(low=-1.0, high=1.0).sample_batch(1000)
+        """
+        if np is None:
+            return [self.sample() for _ in range(n)]
+        return self._sample_batch(n)
+
+    def _sample_batch(self, n):
+        return _as_array([self.sample() for _ in range(n)])
+
+    def _batch_rng(self):
+        return np.random.default_rng(self.rng.getrandbits(128))
+
+    def _cast(self, res):
+        if 'fl' in self.dtype:
+            return res
+        return res.astype(int)
+
     def seed(self, seed_val):
         self.rng.seed(seed_val)
 
@@ -36,6 +74,15 @@ class Sampler(object):
         self.rng.setstate(state)
 
 
+def _as_array(values):
+    array = np.asarray(values)
+    if array.dtype.kind not in 'biuf':
+        # Keep Python objects instead of coercing them to strings.
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+    return array
+
+
 class Constant(Sampler):
 
     def __init__(self, value):
@@ -45,6 +92,9 @@ class Constant(Sampler):
     def sample(self):
         return self.value
 
+    def _sample_batch(self, n):
+        return _as_array([self.value] * n)
+
 
 class Choice(Sampler):
 
@@ -77,6 +127,11 @@ class Choice(Sampler):
         i = int(math.floor(i))
         return self.items[i]
 
+    def _sample_batch(self, n):
+        i = np.asarray(self.sampler.sample_batch(n)) * len(self.items)
+        i = np.floor(i).astype(int)
+        return _as_array(self.items)[i]
+
 
 class Truncated(Sampler):
     """
@@ -113,6 +168,14 @@ class Truncated(Sampler):
             val = self.max
         return val
 
+    def _sample_batch(self, n):
+        val = np.asarray(self.sampler.sample_batch(n))
+        if self.min is not None:
+            val = np.maximum(val, self.min)
+        if self.max is not None:
+            val = np.minimum(val, self.max)
+        return val
+
 
 class Uniform(Sampler):
     '''
@@ -142,6 +205,10 @@ class Uniform(Sampler):
             return res
         return int(res)
 
+    def _sample_batch(self, n):
+        res = self._batch_rng().uniform(self.low, self.high, n)
+        return self._cast(res)
+
 
 class Gaussian(Sampler):
     '''
@@ -171,6 +238,10 @@ class Gaussian(Sampler):
             return res
         return int(res)
 
+    def _sample_batch(self, n):
+        res = self._batch_rng().normal(self.mean, self.std, n)
+        return self._cast(res)
+
 
 class Normal(Gaussian):
     pass
@@ -204,6 +275,10 @@ class LognormVariate(Sampler):
             return res
         return int(res)
 
+    def _sample_batch(self, n):
+        res = self._batch_rng().lognormal(self.mean, self.std, n)
+        return self._cast(res)
+
 
 class BetaVariate(Sampler):
     '''
@@ -233,6 +308,10 @@ class BetaVariate(Sampler):
             return res
         return int(res)
 
+    def _sample_batch(self, n):
+        res = self._batch_rng().beta(self.alpha, self.beta, n)
+        return self._cast(res)
+
 
 class ExpoVariate(Sampler):
     '''
@@ -260,6 +339,10 @@ class ExpoVariate(Sampler):
             return res
         return int(res)
 
+    def _sample_batch(self, n):
+        res = self._batch_rng().exponential(1.0 / self.lam, n)
+        return self._cast(res)
+
 
 class WeibullVariate(Sampler):
     '''
@@ -289,6 +372,10 @@ class WeibullVariate(Sampler):
             return res
         return int(res)
 
+    def _sample_batch(self, n):
+        res = self.alpha * self._batch_rng().weibull(self.beta, n)
+        return self._cast(res)
+
 
 class ParetoVariate(Sampler):
     '''
@@ -315,3 +402,8 @@ class ParetoVariate(Sampler):
         if 'fl' in self.dtype:
             return res
         return int(res)
+
+    def _sample_batch(self, n):
+        # NumPy's Pareto is shifted by the scale, Python's is not.
+        res = self._batch_rng().pareto(self.alpha, n) + 1.0
+        return self._cast(res)
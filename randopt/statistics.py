@@ -160,6 +160,25 @@ def _sum(data, start=0):
     return (T, total, count)
 
 
+def _fast_sum(data):
+    """Return (type, sum) of data holding only floats and ints, or None.
+
+    Floats are summed with math.fsum, which is correctly rounded and much
+    faster than the exact Fraction arithmetic of ``_sum``. Ints are summed
+    exactly, and the sum is returned as a Fraction. None is returned for
+    other types, and for infinite sums, which ``_sum`` handles.
+    """
+    types = set(map(type, data))
+    if not types or not types <= {float, int}:
+        return None
+    if float not in types:
+        return int, Fraction(sum(data))
+    try:
+        return float, math.fsum(data)
+    except (OverflowError, ValueError):
+        return None
+
+
 def _isfinite(x):
     try:
         return x.is_finite()  # Likely a Decimal.
@@ -309,6 +328,10 @@ def mean(data):
     n = len(data)
     if n < 1:
         raise StatisticsError('mean requires at least one data point')
+    fast = _fast_sum(data)
+    if fast is not None:
+        T, total = fast
+        return _convert(total/n, T)
     T, total, count = _sum(data)
     assert count == n
     return _convert(total/n, T)
@@ -531,6 +554,9 @@ def _ss(data, c=None):
     calculated from ``c`` as given. Use the second case with care, as it can
     lead to garbage results.
     """
+    fast = _fast_ss(data, c)
+    if fast is not None:
+        return fast
     if c is None:
         c = mean(data)
     T, total, count = _sum((x-c)**2 for x in data)
@@ -543,6 +569,34 @@ def _ss(data, c=None):
     return (T, total)
 
 
+def _fast_ss(data, c=None):
+    """Return (type, sum of square deviations) of data holding only floats
+    and ints, or None.
+
+    Uses the same compensated two-pass algorithm as ``_ss``, with math.fsum
+    for floats and exact integer arithmetic for ints.
+    """
+    fast = _fast_sum(data)
+    if fast is None or not (c is None or type(c) in (float, int)):
+        return None
+    T, total = fast
+    n = len(data)
+    if T is int and type(c) is not float:
+        c = 0 if c is None else c
+        deviations = [x - c for x in data]
+        ss = sum(d * d for d in deviations)
+        return (T, ss - Fraction(sum(deviations) ** 2, n))
+    if c is None:
+        c = total / n
+    deviations = [x - c for x in data]
+    try:
+        ss = math.fsum(d * d for d in deviations)
+        ss -= math.fsum(deviations) ** 2 / n
+    except (OverflowError, ValueError):
+        return None
+    return (float, max(ss, 0.0))
+
+
 def variance(data, xbar=None):
     """Return the sample variance of data.
 
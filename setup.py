@@ -30,5 +30,6 @@ setup(
     scripts=[
         'bin/roviz.py',
         'bin/ropt.py',
+        'bin/romigrate.py',
         ]
     )
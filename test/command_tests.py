@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import shutil
+import unittest
+import randopt as ro
+
+from randopt.command import run_batch
+
+
+@ro.experiment('test_command_unit_tests')
+def command_tests_square(x=2, y=3):
+    if x < 0:
+        raise ValueError('x should be positive')
+    return x**2 + y**2, {'pid': os.getpid()}
+
+
+class TestCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.exp = ro.Experiment('test_command_unit_tests')
+
+    def tearDown(self):
+        shutil.rmtree(self.exp.experiment_path)
+
+    def test_batch(self):
+        lines = [json.dumps({'x': i}) for i in range(10)] + ['']
+        outputs = run_batch('command_tests_square', lines)
+        self.assertEqual([o[0] for o in outputs], [i**2 + 9 for i in range(10)])
+        self.assertEqual(self.exp.count(), 10)
+        self.assertEqual(self.exp.minimum().result, 9)
+        self.assertEqual(self.exp.maximum().x, 9)
+        self.assertEqual(self.exp.maximum().y, 3)
+        self.assertEqual(self.exp.maximum().pid, os.getpid())
+
+    def test_batch_workers(self):
+        lines = [json.dumps({'x': i, 'y': 0}) for i in range(20)]
+        run_batch('command_tests_square', lines, workers=2)
+        self.assertEqual(self.exp.count(), 20)
+        results = self.exp.list()
+        self.assertEqual(sorted(r.result for r in results),
+                         [i**2 for i in range(20)])
+        self.assertNotIn(os.getpid(), results.values('pid'))
+
+    def test_batch_failures(self):
+        for workers in [None, 2]:
+            lines = [json.dumps({'x': x}) for x in [1, -1, 2]]
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                outputs = run_batch('command_tests_square', lines, workers)
+            finally:
+                errors, sys.stderr = sys.stderr.getvalue(), stderr
+            self.assertIn('x should be positive', errors)
+            self.assertEqual(outputs[1], None)
+            self.assertEqual([o[0] for o in outputs[::2]], [10, 13])
+            self.assertEqual(self.exp.count(), 3)
+            self.assertEqual([r.result for r in self.exp.top(3)], [10, 13])
+            failed = self.exp.filter(lambda r: r.result is None)
+            self.assertEqual(failed[0].status, 'failed')
+            self.assertEqual(failed[0].x, -1)
+            self.exp.storage.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from randopt.executor import Executor, WorkerExecutor, Slot, cpu_slots
+
+
+def is_running(pid):
+    stat = '/proc/' + str(pid) + '/stat'
+    if os.path.exists('/proc'):
+        # Killed orphans stay zombies until init reaps them.
+        try:
+            with open(stat) as f:
+                return f.read().split(')')[-1].split()[0] != 'Z'
+        except IOError:
+            return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parallel(self):
+        log_dir = os.path.join(self.directory, 'logs')
+        executor = Executor(n_processes=4, log_dir=log_dir, verbose=False)
+        commands = ['sleep 0.5; echo ' + str(i) for i in range(4)]
+        commands.append('exit 3')
+        start = time.time()
+        codes = executor.run(commands)
+        self.assertLess(time.time() - start, 1.9)
+        self.assertEqual(codes, [0, 0, 0, 0, 3])
+        prefix = os.path.join(log_dir, str(os.getpid()) + '_2')
+        with open(prefix + '.out') as f:
+            self.assertEqual(f.read(), '2\n')
+
+    def test_back_pressure(self):
+        started = []
+
+        def commands():
+            for i in range(6):
+                started.append(time.time())
+                yield 'sleep 0.3'
+
+        Executor(n_processes=2, verbose=False).run(commands())
+        # The third command is drawn once one of the first two finished.
+        self.assertGreater(started[2] - started[0], 0.25)
+
+    def test_shutdown(self):
+        pid_file = os.path.join(self.directory, 'pid')
+
+        def commands():
+            yield 'sleep 30 & echo $! > ' + pid_file + '; wait'
+            while not os.path.exists(pid_file) or \
+                    os.path.getsize(pid_file) == 0:
+                time.sleep(0.05)
+            raise KeyboardInterrupt
+
+        executor = Executor(n_processes=2, kill_timeout=1.0, verbose=False)
+        with self.assertRaises(KeyboardInterrupt):
+            executor.run(commands())
+        self.assertEqual(executor.running, [])
+        with open(pid_file) as f:
+            pid = int(f.read())
+        # The background child of the command was terminated too.
+        time.sleep(0.1)
+        self.assertFalse(is_running(pid))
+
+    def test_env_slots(self):
+        log_dir = os.path.join(self.directory, 'logs')
+        slots = [Slot(env={'FAKE_GPU': str(i)}) for i in range(2)]
+        executor = Executor(log_dir=log_dir, slots=slots, verbose=False)
+        start = time.time()
+        executor.run(['sleep 0.5; echo $FAKE_GPU'] * 4)
+        self.assertLess(time.time() - start, 1.4)
+        values = []
+        for i in range(4):
+            prefix = os.path.join(log_dir, str(os.getpid()) + '_' + str(i))
+            with open(prefix + '.out') as f:
+                values.append(f.read().strip())
+        # Commands running at the same time never share a slot.
+        self.assertEqual(sorted(values[:2]), ['0', '1'])
+        self.assertEqual(sorted(values[2:]), ['0', '1'])
+
+    def test_resource_slots(self):
+        if not hasattr(os, 'sched_getaffinity'):
+            return
+        log_dir = os.path.join(self.directory, 'logs')
+        slots = cpu_slots(1, memory=512 * 2**20)
+        self.assertEqual(len(slots), len(os.sched_getaffinity(0)))
+        slot = slots[-1]
+        executor = Executor(log_dir=log_dir, slots=[slot], verbose=False)
+        script = ('import os; print(sorted(os.sched_getaffinity(0)), '
+                  'os.environ["OMP_NUM_THREADS"]); b"x" * 2**30')
+        codes = executor.run(['python -c \'' + script + '\''])
+        self.assertNotEqual(codes, [0])
+        prefix = os.path.join(log_dir, str(os.getpid()) + '_0')
+        with open(prefix + '.out') as f:
+            threads = os.environ.get('OMP_NUM_THREADS', '1')
+            self.assertEqual(f.read().strip(), str(slot.cpus) + ' ' + threads)
+        with open(prefix + '.err') as f:
+            self.assertIn('MemoryError', f.read())
+
+    def test_timeout_and_retries(self):
+        finished = []
+        executor = Executor(n_processes=2, timeout=0.5, retries=1,
+                            kill_timeout=0.5, verbose=False,
+                            callback=finished.append)
+        marker = os.path.join(self.directory, 'marker')
+        # Ignores SIGTERM, so that it has to be killed.
+        hung = 'trap "" TERM; sleep 30'
+        flaky = 'test -e {0} || (touch {0}; exit 1)'.format(marker)
+        start = time.time()
+        codes = executor.run([hung, flaky, 'exit 2'])
+        self.assertLess(time.time() - start, 5.0)
+        self.assertEqual(codes[1:], [0, 2])
+        self.assertLess(codes[0], 0)
+        statuses = {job.index: (job.status, job.attempts) for job in finished}
+        self.assertEqual(statuses, {0: ('timeout', 2), 1: ('ok', 2),
+                                    2: ('failed', 2)})
+
+    def test_straggler(self):
+        finished = []
+        executor = Executor(n_processes=2, straggler=0.5, verbose=False,
+                            callback=finished.append)
+        commands = ['sleep 0.1'] * 6 + ['sleep 30']
+        start = time.time()
+        executor.run(commands)
+        self.assertLess(time.time() - start, 5.0)
+        self.assertEqual(finished[-1].status, 'straggler')
+        self.assertEqual(finished[-1].index, 6)
+
+    def test_workers(self):
+        finished = []
+        script = os.path.join(os.path.dirname(__file__), 'ropt_worker.py')
+        executor = WorkerExecutor('python ' + script + ' square',
+                                  n_processes=2, timeout=2.0, kill_timeout=0.5,
+                                  verbose=False, callback=finished.append,
+                                  log_dir=os.path.join(self.directory, 'logs'))
+        trials = [{'x': float(i)} for i in range(10)]
+        trials += [{'x': -1.0}, {'x': 2.0, 'wait': 30.0}, {'x': 3.0}]
+        codes = executor.run(trials)
+        self.assertEqual(codes[:11], [0] * 10 + [1])
+        self.assertLess(codes[11], 0)
+        self.assertEqual(codes[12], 0)
+        jobs = sorted(finished, key=lambda job: job.index)
+        self.assertEqual([job.result for job in jobs[:10]],
+                         [float(i**2) for i in range(10)])
+        self.assertEqual([job.status for job in jobs[10:]],
+                         ['failed', 'timeout', 'ok'])
+        # Workers are reused across trials, and killed on timeout.
+        self.assertEqual(len(set(job.process.pid for job in jobs[:11])), 2)
+        self.assertNotEqual(jobs[11].process.returncode, 0)
+        self.assertEqual(jobs[12].process.returncode, 0)
+        self.assertEqual(executor.workers, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
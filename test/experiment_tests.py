@@ -5,10 +5,24 @@ import os #for various directory functions
 import shutil #for shutil.rmtree
 import json #for json.load()
 import time #for time.sleep
+import multiprocessing
+import statistics
 
 #TODO: Test Experiment.save_state, amd Experiment.set_state
 
 
+def reserve_hyperband(args):
+    name, start, runs = args
+    time.sleep(max(start - time.time(), 0.0))
+    params = {'alpha': ro.Uniform(0.0, 1.0)}
+    assigned = []
+    for _ in range(runs):
+        exp = ro.HyperBand(name, params, num_iter=27, eta=3)
+        exp.sample_all_params()
+        assigned.append(exp.s)
+    return assigned
+
+
 class TestExperiment(unittest.TestCase):
     def setUp(self):
         self.expName = 'test_experiment_unit_tests'
@@ -168,9 +182,9 @@ class TestExperiment(unittest.TestCase):
         cwd = os.getcwd()
         randopt_folder = os.path.join(cwd, 'randopt_results')
         experiment_path = os.path.join(randopt_folder, self.expName)
-        files = os.listdir(experiment_path)
+        files = [f for f in os.listdir(experiment_path) if f.endswith('.json')]
 
-        #confirm that only 1 file was written
+        #confirm that only 1 result file was written
         self.assertEquals(len(files), 1)
 
         #confirm that the file was written properly
@@ -197,3 +211,396 @@ class TestExperiment(unittest.TestCase):
             self.assertEquals(exp_seen[int(res.result)], 1)
         self.assertEquals(count, nResults)
         self.assertEquals(sum(exp_seen), nResults)
+
+    def test_index_covers_results(self):
+        for i in range(3):
+            self.exp.add_result(i)
+        index_path = os.path.join(self.exp.experiment_path, '_index')
+        self.assertTrue(os.path.exists(index_path))
+        with open(index_path, 'r') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(len(entries), 3)
+        for entry in entries:
+            fpath = os.path.join(self.exp.experiment_path, entry['file'])
+            self.assertTrue(os.path.exists(fpath + '.json'))
+        self.assertEqual(sorted(e['summary']['result'] for e in entries),
+                         [0, 1, 2])
+
+    def test_index_picks_up_unindexed_files(self):
+        self.exp.add_result(5)
+        self.assertEqual(self.exp.count(), 1)
+        # Results written without the index are still found
+        fpath = os.path.join(self.exp.experiment_path, 'external.json')
+        with open(fpath, 'w') as f:
+            json.dump({'result': 1, 'param1': 3, 'param2': 4}, f)
+        self.assertEqual(self.exp.count(), 2)
+        self.assertEqual(self.exp.minimum().result, 1)
+        self.assertEqual(self.exp.minimum().param1, 3)
+        # And are added to the index for other readers
+        other = ro.Experiment(self.expName)
+        other.storage.index.refresh()
+        self.assertIn('external', other.storage.index.summaries)
+        with open(os.path.join(self.exp.experiment_path, '_index')) as f:
+            self.assertEqual(sum('external' in line for line in f), 1)
+        os.remove(fpath)
+        self.assertEqual(self.exp.count(), 1)
+        self.assertEqual(self.exp.minimum().result, 5)
+
+    def test_index_lists_changed_folders(self):
+        path = self.exp.experiment_path
+        os.utime(path, (0, 0))
+        self.assertEqual(self.exp.count(), 0)
+        # The folder is not listed again while its mtime is unchanged.
+        with open(os.path.join(path, 'external.json'), 'w') as f:
+            json.dump({'result': 1}, f)
+        os.utime(path, (0, 0))
+        self.assertEqual(self.exp.count(), 0)
+        os.utime(path, None)
+        self.assertEqual(self.exp.count(), 1)
+
+    def test_top_custom_comparator(self):
+        for i in [3, 1, 4, 1, 5, 9, 2, 6]:
+            self.exp.set('param1', i)
+            self.exp.add_result(i)
+        topN = self.exp.top(3, fn=lambda x, y: x.result >= y.result)
+        self.assertEqual([r.result for r in topN], [9, 6, 5])
+        self.assertEqual([int(r.param1) for r in topN], [9, 6, 5])
+        topN = self.exp.top(4)
+        self.assertEqual([r.result for r in topN], [1, 1, 2, 3])
+        self.assertEqual(len(self.exp.top(0)), 0)
+
+    def test_sample_batch_add_results(self):
+        self.exp.seed(100)
+        batch = self.exp.sample_batch(20)
+        self.assertEqual(sorted(batch.keys()), ['param1', 'param2'])
+        self.assertEqual(len(batch['param1']), 20)
+        results = [2 * p for p in batch['param1']]
+        self.exp.add_results(batch, results,
+                             data=[{'i': i} for i in range(20)])
+        self.assertEqual(self.exp.count(), 20)
+        for res in self.exp.all_results():
+            self.assertEqual(res.result, 2 * res.param1)
+            self.assertEqual(batch['param2'][res.i], res.param2)
+        with self.assertRaises(ValueError):
+            self.exp.add_results(batch, results[:3])
+
+    def test_buffered_add_result(self):
+        exp = ro.Experiment(self.expName, self.exp.params, buffered=True,
+                            flush_size=1000, flush_interval=60.0)
+        for i in range(10):
+            exp.set('param1', i)
+            exp.add_result(i, attachment={'i': i} if i == 9 else None)
+        # Nothing is written until the buffer is flushed
+        files = [f for f in os.listdir(exp.experiment_path)
+                 if f.endswith('.json')]
+        self.assertEqual(len(files), 0)
+        self.assertEqual(exp.count(), 10)
+        self.assertEqual(exp.maximum().attachment, {'i': 9})
+        with ro.Experiment(self.expName, self.exp.params, buffered=True,
+                           flush_interval=0.01) as exp:
+            exp.add_result(-1)
+            time.sleep(0.5)
+            self.assertEqual(self.exp.count(), 11)
+            exp.add_result(-2)
+        self.assertEqual(self.exp.minimum().result, -2)
+
+    def test_snapshot(self):
+        try:
+            import numpy
+        except ImportError:
+            return
+        for i in range(5):
+            self.exp.set('param1', i)
+            self.exp.add_result(i / 2.0, data={'tag': str(i), 'curve': [i, i]})
+        snapshot = self.exp.snapshot()
+        self.assertEqual(len(snapshot), 5)
+        self.assertTrue(snapshot.columns['param1'].integer)
+        self.assertFalse(snapshot.columns['tag'].numeric)
+        self.exp.set('param1', 5)
+        self.exp.add_result(2.5, data={'extra': True})
+        results = self.exp.list()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(sorted(r.result for r in results),
+                         [0.0, 0.5, 1.0, 1.5, 2.0, 2.5])
+        for r in results:
+            self.assertEqual(r.param1, int(r.result * 2))
+            self.assertIsInstance(r.param1, int)
+            if r.param1 < 5:
+                self.assertEqual(r.curve, [r.param1, r.param1])
+                self.assertEqual(r.tag, str(r.param1))
+                self.assertNotIn('extra', r)
+            else:
+                self.assertIs(r.extra, True)
+                self.assertNotIn('tag', r)
+        self.assertEqual(self.exp.snapshot().marker,
+                         ro.Experiment(self.expName).snapshot().marker)
+        # Results written without the index are added to the snapshot
+        fpath = os.path.join(self.exp.experiment_path, 'external.json')
+        with open(fpath, 'w') as f:
+            json.dump({'result': -1, 'param1': 9}, f)
+        self.assertEqual(len(self.exp.list()), 7)
+        self.assertEqual(len(self.exp.snapshot()), 7)
+        # An up-to-date snapshot is not written again by list().
+        path = os.path.join(self.exp.experiment_path, '_snapshot.npz')
+        mtime = os.stat(path).st_mtime_ns
+        os.utime(path, ns=(mtime - 10**9, mtime - 10**9))
+        self.assertEqual(len(self.exp.list()), 7)
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime - 10**9)
+        self.assertFalse(any(f.endswith('.tmp')
+                             for f in os.listdir(self.exp.experiment_path)))
+
+    def test_summary_list_columns(self):
+        for i in [3, 1, 4, 1, 5, 9, 2, 6]:
+            self.exp.set('param1', i)
+            self.exp.add_result(i * 0.5, data={'curve': [i, 2 * i]})
+        results = self.exp.list()
+        self.assertAlmostEqual(results.mean(), 3.875 * 0.5)
+        self.assertEqual(results.max('param1'), 9)
+        self.assertEqual(results.min('curve'), [1, 2])
+        self.assertAlmostEqual(results.variance('param1'), 6.609375)
+        self.assertEqual(results.median('param1'), 3.5)
+        ordered = results.sort_by('param1')
+        self.assertEqual([r.param1 for r in ordered], [1, 1, 2, 3, 4, 5, 6, 9])
+        self.assertEqual(ordered[5:].mean('param1'), 20 / 3.0)
+        ordered = results.sort_by('result', reverse=True)
+        self.assertEqual(ordered[0].param1, 9)
+        column = results.column('param1')
+        if column is not None:
+            high = results.filter(column > 3)
+            self.assertEqual(sorted(r.param1 for r in high), [4, 5, 6, 9])
+            self.assertEqual(high.min('param1'), 4)
+        self.assertEqual(len(results.filter(lambda r: r.param1 > 3)), 4)
+        # Statistics keep the types returned by the statistics module.
+        for values in [[1, 2, 3], [1, 2], [2, 4, 6, 8]]:
+            integers = ro.SummaryList([{'result': v} for v in values])
+            reducers = {'mean': statistics.mean, 'median': statistics.median,
+                         'variance': statistics.pvariance,
+                         'std': statistics.pstdev, 'min': min, 'max': max}
+            for name, fn in reducers.items():
+                value = getattr(integers, name)()
+                expected = fn(values)
+                self.assertEqual(value, expected)
+                self.assertIs(type(value), type(expected))
+
+    def test_failed_results(self):
+        for i in range(5):
+            self.exp.add_result(float(i))
+        self.exp.add_result(None, data={'status': 'timeout'})
+        self.assertEqual(self.exp.count(), 6)
+        self.assertEqual(self.exp.minimum().result, 0.0)
+        self.assertEqual(self.exp.maximum().result, 4.0)
+        self.assertEqual([r.result for r in self.exp.top(10)],
+                         [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(len(self.exp.filter(lambda r: 'status' in r)), 1)
+        # Failed trials are left out of aggregations.
+        results = self.exp.list()
+        self.assertEqual(results.mean(), 2.0)
+        self.assertEqual(results.min(), 0.0)
+        self.assertEqual(results.max(), 4.0)
+        self.assertEqual(results.median(), 2.0)
+        self.assertAlmostEqual(results.std(), 2.0**0.5)
+        results = ro.SummaryList(list(self.exp.all_results()))
+        self.assertEqual(results.map(max), 4.0)
+
+    def test_asha(self):
+        params = {'alpha': ro.Uniform(0.0, 1.0)}
+        exps = [ro.ASHA(self.expName, params, num_iter=9, eta=3)
+                for _ in range(2)]
+        self.assertEqual(exps[0].milestones, [1, 3])
+        alphas = [0.5, 0.9, 0.1, 0.7, 0.3, 0.8, 0.2, 0.6, 0.4]
+        iterations = []
+        for trial, alpha in enumerate(alphas):
+            # Workers interleave, and see each other's rung scores.
+            exp = exps[trial % 2]
+            exp.sample_all_params()
+            exp.set('alpha', alpha)
+            for it in range(1, 10):
+                if exp.stop(exp.alpha * it):
+                    break
+            iterations.append(it)
+        self.assertEqual(iterations, [9, 1, 9, 1, 3, 1, 9, 1, 1])
+        exps[0].rungs.refresh()
+        self.assertEqual(exps[0].rungs.scores(0), sorted(alphas))
+        self.assertEqual(exps[1].rungs.scores(1),
+                         [0.1 * 3, 0.2 * 3, 0.3 * 3, 0.5 * 3])
+        # Scores in the top 1/eta of their rung continue.
+        exp = exps[0]
+        exp.curr_iter = 0
+        self.assertFalse(exp.stop(-1.0))
+        exp.curr_iter = 0
+        self.assertTrue(exp.stop(2.0))
+
+    def test_grid_search(self):
+        params = {'x': ro.Choice([1, 2, 3]), 'y': ro.Choice(['a', 'b'])}
+        grids = [ro.GridSearch(ro.Experiment(self.expName, params))
+                 for _ in range(2)]
+        self.assertEqual(grids[0].size, 6)
+        seen = []
+        for i in range(12):
+            # Each grid sees the results added through the other.
+            gs = grids[i % 2]
+            gs.sample_all_params()
+            seen.append((gs.x, gs.y))
+            gs.add_result(i)
+        self.assertEqual(sorted(set(seen[:6])), sorted(set(seen)))
+        self.assertEqual(len(set(seen[:6])), 6)
+        self.assertEqual(sum(grids[0].counts.values()), 11)
+        self.assertEqual(grids[1].counts, {i: 2 for i in range(6)})
+        grids[0].refresh_index()
+        self.assertEqual(grids[0].counts, {i: 2 for i in range(6)})
+        # Results outside of the grid are not counted.
+        gs.set('x', 4)
+        gs.add_result(0)
+        self.assertEqual(sum(gs.counts.values()), 12)
+        gs.set('x', 2)
+        self.assertEqual(gs.sample('y'), 'a')
+        # Counting new results does not list the results folder.
+        listdir = os.listdir
+        listed = []
+        os.listdir = lambda path: listed.append(path) or listdir(path)
+        try:
+            gs.sample_all_params()
+            gs.add_result(0)
+        finally:
+            os.listdir = listdir
+        self.assertEqual(listed, [])
+        self.assertEqual(sum(gs.counts.values()), 13)
+        # Points sampled before their results are added are not repeated.
+        points = []
+        for _ in range(5):
+            points.append(tuple(gs.sample_all_params().values()))
+        self.assertEqual(len(set(points)), 5)
+        self.assertEqual(sum(gs.leases.values()), 5)
+        gs.add_result(0)
+        self.assertEqual(sum(gs.leases.values()), 4)
+        self.assertEqual(sum(gs.counts.values()), 18)
+
+    def test_large_grid_search(self):
+        # Only executed points of the 1e8 points grid are stored.
+        params = {'p' + str(i): ro.Choice(list(range(10))) for i in range(8)}
+        gs = ro.GridSearch(ro.Experiment(self.expName, params))
+        self.assertEqual(gs.size, 10**8)
+        for i in range(12):
+            gs.sample_all_params()
+            self.assertEqual([gs.current['p' + str(j)] for j in range(8)],
+                             [0] * 6 + [i // 10, i % 10])
+            gs.add_result(i)
+        self.assertEqual(len(gs.counts), 12)
+        self.assertEqual(gs.sample('p0'), 1)
+
+    def test_sharded_grid_search(self):
+        params = {'x': ro.Choice([1, 2, 3]), 'y': ro.Choice(['a', 'b', 'c'])}
+        shards = [ro.GridSearch(ro.Experiment(self.expName, params),
+                                shard_id=i, num_shards=2) for i in range(2)]
+        seen = [[], []]
+        for i in range(9):
+            # Both workers sample before seeing each other's results.
+            for shard, points in zip(shards, seen):
+                shard.sample_all_params()
+                points.append((shard.x, shard.y))
+            for shard in shards:
+                shard.add_result(i)
+        self.assertEqual(len(set(seen[0][:5])), 5)
+        self.assertEqual(len(set(seen[1][:4])), 4)
+        self.assertEqual(len(set(seen[0][:5] + seen[1][:4])), 9)
+        self.assertEqual(seen[0][5], seen[0][0])
+        with self.assertRaises(AssertionError):
+            ro.GridSearch(ro.Experiment(self.expName, params), 2, 2)
+
+    def test_hyperband(self):
+        params = {'alpha': ro.Uniform(0.0, 1.0)}
+        exp = ro.HyperBand(self.expName, params, num_iter=9, eta=3)
+        brackets = exp.brackets
+        for trial in range(12):
+            exp = ro.HyperBand(self.expName, params, num_iter=9, eta=3)
+            exp.sample_all_params()
+            for it in range(9):
+                if exp.stop(exp.alpha):
+                    break
+        brackets.refresh()
+        self.assertEqual(sum(brackets.count(s) for s in range(3)), 12)
+        self.assertEqual(len(brackets.runs), 12)
+        scores = [key.obj for key in brackets.scores[1]]
+        self.assertEqual(scores, sorted(scores))
+        self.assertEqual(brackets.rank(1, scores[1]), 1)
+        self.assertEqual(brackets.rank(1, scores[-1] + 1.0), 12)
+        # Only files updated since the last refresh are read again.
+        load = brackets._load
+        brackets._load = None
+        brackets.refresh()
+        brackets._load = load
+        # Runs are logged one line per iteration, and a torn line is skipped.
+        with open(exp.hb_file, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), exp.curr_iter + 1)
+        self.assertEqual(json.loads(lines[-1])['iter'], exp.curr_iter)
+        with open(exp.hb_file, 'a') as f:
+            f.write('{"iter": ')
+        brackets.refresh()
+        self.assertEqual(len(brackets.runs[os.path.basename(exp.hb_file)]
+                             ['results']), exp.curr_iter)
+        # Scores among the nb_config best continue.
+        self.assertTrue(exp._continue(1, 2, scores[1]))
+        self.assertFalse(exp._continue(1, 2, scores[2] + 1.0))
+        self.assertTrue(exp._continue(20, 2, 100.0))
+
+    def test_hyperband_workers(self):
+        # Workers starting together are assigned brackets as if in sequence.
+        workers, runs = 8, 10
+        start = time.time() + 0.5
+        pool = multiprocessing.Pool(workers)
+        try:
+            assigned = pool.map(reserve_hyperband,
+                                [(self.expName, start, runs)] * workers)
+        finally:
+            pool.close()
+            pool.join()
+        sequence = reserve_hyperband((self.expName + '_sequence', 0.0,
+                                      workers * runs))
+        shutil.rmtree(os.path.join('randopt_results',
+                                   self.expName + '_sequence'))
+        assigned = sum(assigned, [])
+        for s in set(sequence):
+            self.assertEqual(assigned.count(s), sequence.count(s))
+        exp = ro.HyperBand(self.expName, {}, num_iter=27, eta=3)
+        with open(os.path.join(exp.hyperband_path, '_reservations')) as f:
+            reserved = [json.loads(line)['run'] for line in f]
+        self.assertEqual(len(reserved), workers * runs)
+        self.assertEqual(len(set(reserved)), len(reserved))
+
+    def test_stats(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        for i in values:
+            self.exp.set('param1', i)
+            self.exp.add_result(i * 0.5, data={'curve': [i, 2 * i]})
+        stats = self.exp.stats()
+        results = self.exp.list()
+        self.assertEqual(stats.count(), 8)
+        self.assertAlmostEqual(stats.mean(), results.mean())
+        self.assertAlmostEqual(stats.variance('param1'), 6.609375)
+        self.assertAlmostEqual(stats.std('param1'), results.std('param1'))
+        self.assertEqual(stats.max('curve'), [9, 18])
+        self.assertEqual(stats.median('param1'), 3.5)
+        self.assertEqual(stats.sum('param1'), 31)
+        # Partial statistics of disjoint results combine exactly.
+        first = ro.Accumulators().update(results[:3])
+        second = ro.Accumulators().update(results[3:])
+        merged = first.merge(second)
+        self.assertEqual(merged.count('curve'), [8, 8])
+        self.assertEqual(merged.sum(), stats.sum())
+        self.assertEqual(merged.min('param1'), 1)
+        self.assertAlmostEqual(merged.variance('param1'), 6.609375)
+        # Values of another shape than the first one of their key are ignored.
+        mixed = ro.Accumulators().update([{'x': 1}, {'x': [2, 3]}, {'x': 4},
+                                          {'y': [1, 2]}, {'y': 3}])
+        self.assertEqual(mixed.count('x'), 2)
+        self.assertEqual(mixed.count('y'), [1, 1])
+        mixed.merge(ro.Accumulators().update([{'x': [5]}, {'y': [3, 4]}]))
+        self.assertEqual(mixed.count('x'), 2)
+        self.assertEqual(mixed.max('y'), [3, 4])
+        lengths = ro.Accumulators().update([{'z': [1, 2]}, {'z': [3, 4, 5]},
+                                            {'z': [6]}, {'z': [7, 8]}])
+        self.assertEqual(lengths.count('z'), [2, 2])
+        self.assertEqual(lengths.max('z'), [7, 8])
+        lengths.merge(ro.Accumulators().update([{'z': [9, 9, 9]}]))
+        self.assertEqual(lengths.count('z'), [2, 2])
@@ -17,6 +17,12 @@ class TestRopt(unittest.TestCase):
             del os.environ['ROPT_NAME']
         if 'ROPT_NPROC' in os.environ:
             del os.environ['ROPT_NPROC']
+        if 'ROPT_LOGS' in os.environ:
+            del os.environ['ROPT_LOGS']
+        if 'ROPT_SLOTS' in os.environ:
+            del os.environ['ROPT_SLOTS']
+        if 'ROPT_SHARD' in os.environ:
+            del os.environ['ROPT_SHARD']
         subprocess.call(['make', 'clean'])
 
     def setUp(self):
@@ -40,6 +46,25 @@ class TestRopt(unittest.TestCase):
         self.assertEqual(result.qwer, 1)
         self.assertEqual(result.abcd, 1)
 
+    def test_parallel(self):
+        os.environ['ROPT_NSEARCH'] = '8'
+        os.environ['ROPT_NPROC'] = '4'
+        os.environ['ROPT_LOGS'] = os.path.join('randopt_results', 'logs')
+        command = 'ropt.py python test/ropt_simple.py --asdf=Uniform(0,1) --qwer=1 --abcd=1'.split(' ')
+        subprocess.call(command, shell=False)
+        self.assertEqual(self.experiment.count(), 8)
+        logs = os.listdir(os.environ['ROPT_LOGS'])
+        self.assertEqual(len(logs), 16)
+
+    def test_slots(self):
+        os.environ['ROPT_NSEARCH'] = '4'
+        os.environ['ROPT_SLOTS'] = 'FAKE_GPU=0 1'
+        os.environ['ROPT_LOGS'] = os.path.join('randopt_results', 'logs')
+        command = 'ropt.py python test/ropt_simple.py --asdf=Uniform(0,1) --qwer=1 --abcd=1'.split(' ')
+        subprocess.call(command, shell=False)
+        self.assertEqual(self.experiment.count(), 4)
+        self.assertEqual(len(os.listdir(os.environ['ROPT_LOGS'])), 8)
+
     def test_grid_search(self):
         os.environ['ROPT_NSEARCH'] = '8'
         os.environ['ROPT_TYPE'] = 'GridSearch'
@@ -54,6 +79,31 @@ class TestRopt(unittest.TestCase):
             self.assertIn(res.qwer, [1, 2])
             self.assertIn(res.asdf, [1, 2])
 
+    def test_parallel_grid_search(self):
+        os.environ['ROPT_NSEARCH'] = '8'
+        os.environ['ROPT_NPROC'] = '4'
+        os.environ['ROPT_LOGS'] = os.path.join('randopt_results', 'logs')
+        os.environ['ROPT_TYPE'] = 'GridSearch'
+        os.environ['ROPT_NAME'] = 'ropt_test'
+        command = 'ropt.py python test/ropt_simple.py --abcd=Choice([1,2]) --qwer=Choice([1,2]) --asdf=Choice([1,2])'.split(' ')
+        subprocess.call(command, shell=False)
+        points = set((r.abcd, r.qwer, r.asdf)
+                     for r in self.experiment.all_results())
+        self.assertEqual(self.experiment.count(), 8)
+        self.assertEqual(len(points), 8)
+
+    def test_sharded_grid_search(self):
+        os.environ['ROPT_NSEARCH'] = '4'
+        os.environ['ROPT_TYPE'] = 'GridSearch'
+        os.environ['ROPT_NAME'] = 'ropt_test'
+        command = 'ropt.py python test/ropt_simple.py --abcd=Choice([1,2]) --qwer=Choice([1,2]) --asdf=Choice([1,2])'.split(' ')
+        for shard in ['0/2', '1/2']:
+            os.environ['ROPT_SHARD'] = shard
+            subprocess.call(command, shell=False)
+        points = set((r.abcd, r.qwer, r.asdf)
+                     for r in self.experiment.all_results())
+        self.assertEqual(len(points), 8)
+
     def test_evolutionary(self):
         os.environ['ROPT_NSEARCH'] = '1'
         command = 'ropt.py python test/ropt_simple.py --asdf=1 --qwer=1 --abcd=1'.split(' ')
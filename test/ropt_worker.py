@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+import time
+import randopt as ro
+
+
+@ro.cli
+def square(x=0.0, wait=0.0):
+    time.sleep(wait)
+    if x < 0:
+        raise ValueError('x must be positive')
+    return x**2
+
+
+if __name__ == '__main__':
+    ro.parse()
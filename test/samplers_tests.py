@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import unittest
+import randopt as ro
+import randopt.samplers as samplers
+
+
+class TestSamplers(unittest.TestCase):
+
+    def setUp(self):
+        self.samplers = [
+            ro.Uniform(low=-1.0, high=1.0),
+            ro.Uniform(low=0.0, high=100.0, dtype='int'),
+            ro.Gaussian(mean=0.0, std=1.0),
+            ro.LognormVariate(mean=0.0, std=1.0),
+            ro.BetaVariate(alpha=1.0, beta=2.0),
+            ro.ExpoVariate(lam=2.0),
+            ro.WeibullVariate(alpha=1.0, beta=1.5),
+            ro.ParetoVariate(alpha=3.0),
+            ro.Choice([1, 2, 3]),
+            ro.Choice(['a', 'b']),
+            ro.Truncated(ro.Gaussian(0.0, 1.0), low=-0.1, high=0.1),
+            ro.Constant(3),
+        ]
+
+    def test_sample_batch_seeding(self):
+        for sampler in self.samplers:
+            sampler.seed(1234)
+            first = list(sampler.sample_batch(50))
+            sampler.seed(1234)
+            second = list(sampler.sample_batch(50))
+            self.assertEqual(len(first), 50)
+            self.assertEqual(first, second)
+
+    def test_sample_batch_state(self):
+        for sampler in self.samplers:
+            state = sampler.get_state()
+            first = list(sampler.sample_batch(20))
+            sampler.set_state(state)
+            second = list(sampler.sample_batch(20))
+            self.assertEqual(first, second)
+
+    def test_sample_batch_values(self):
+        values = ro.Uniform(low=0.0, high=100.0, dtype='int').sample_batch(1000)
+        self.assertTrue(all(0 <= v < 100 and int(v) == v for v in values))
+        values = ro.Choice(['a', 'b']).sample_batch(100)
+        self.assertEqual(set(values), {'a', 'b'})
+        values = ro.Truncated(ro.Gaussian(0.0, 1.0), low=-0.1,
+                              high=0.1).sample_batch(100)
+        self.assertTrue(all(-0.1 <= v <= 0.1 for v in values))
+        values = ro.ParetoVariate(alpha=3.0).sample_batch(1000)
+        self.assertTrue(all(v >= 1.0 for v in values))
+
+    def test_sample_batch_without_numpy(self):
+        np = samplers.np
+        samplers.np = None
+        try:
+            sampler = ro.Gaussian(mean=0.0, std=1.0)
+            sampler.seed(1234)
+            values = sampler.sample_batch(10)
+            sampler.seed(1234)
+            self.assertEqual(values, [sampler.sample() for _ in range(10)])
+        finally:
+            samplers.np = np
+
+
+if __name__ == '__main__':
+    unittest.main()
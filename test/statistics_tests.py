@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+from fractions import Fraction
+from decimal import Decimal
+
+from randopt import statistics
+
+
+class TestStatistics(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(1234)
+
+    def tearDown(self):
+        pass
+
+    def test_float_path(self):
+        data = [random.gauss(0.0, 1000.0) for _ in range(100)]
+        data += [random.randint(-100, 100) for _ in range(100)]
+        exact_mean = float(sum(Fraction(x) for x in data) / len(data))
+        self.assertAlmostEqual(statistics.mean(data), exact_mean, places=12)
+        exact_var = float(sum((Fraction(x) - Fraction(exact_mean))**2
+                              for x in data) / len(data))
+        self.assertAlmostEqual(statistics.pvariance(data) / exact_var, 1.0,
+                               places=12)
+        # Catastrophic cancellation is avoided by math.fsum.
+        self.assertEqual(statistics.mean([1e50, 1.0, -1e50] * 1000), 1 / 3.0)
+
+    def test_int_path(self):
+        self.assertEqual(statistics.mean([1, 2, 3]), 2)
+        self.assertTrue(isinstance(statistics.mean([1, 2, 3]), int))
+        self.assertEqual(statistics.mean([1, 2]), 1.5)
+        self.assertEqual(statistics.pvariance([1, 2, 2, 4, 4, 4, 5, 6]), 2.5)
+        self.assertEqual(statistics.variance([1, 3, 5], 3), 4)
+
+    def test_exact_path(self):
+        data = [Fraction(1, 6), Fraction(1, 2), Fraction(5, 3)]
+        self.assertEqual(statistics.variance(data), Fraction(67, 108))
+        data = [Decimal('0.5'), Decimal('0.75'), Decimal('0.625')]
+        self.assertEqual(statistics.mean(data), Decimal('0.625'))
+        self.assertEqual(statistics.mean([1e308, 1e308, -1e308]), 1e308 / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import unittest
+import randopt as ro
+
+from randopt.experiment.storage import LogStorage, migrate, JOURNAL_DIR
+
+try:
+    import cPickle as pk
+except ImportError:
+    import pickle as pk
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.expName = 'test_storage_unit_tests'
+        self.params = {
+            'param1': ro.Uniform(low=0.0, high=100.0, dtype='int'),
+        }
+
+    def tearDown(self):
+        experiment_path = os.path.join(os.getcwd(), 'randopt_results',
+                                       self.expName)
+        shutil.rmtree(experiment_path)
+
+    def test_log_backend(self):
+        exp = ro.Experiment(self.expName, self.params, backend='log')
+        for i in range(5):
+            exp.set('param1', i)
+            exp.add_result(i, attachment={'i': i})
+        files = os.listdir(exp.experiment_path)
+        self.assertFalse(any(f.endswith('.json') for f in files))
+        self.assertEqual(exp.count(), 5)
+        self.assertEqual(exp.minimum().result, 0)
+        self.assertEqual(exp.maximum().param1, 4)
+        self.assertEqual(exp.maximum().attachment, {'i': 4})
+        self.assertEqual([r.result for r in exp.top(2)], [0, 1])
+        self.assertEqual(sorted(r.result for r in exp.all_results()),
+                         list(range(5)))
+
+    def test_log_rotation(self):
+        exp = ro.Experiment(self.expName, self.params, backend='log')
+        exp.storage = LogStorage(exp.experiment_path, segment_size=1)
+        for i in range(3):
+            exp.add_result(i)
+        self.assertEqual(len(exp.storage._segments()), 3)
+        self.assertEqual(exp.count(), 3)
+
+    def test_sqlite_backend(self):
+        exp = ro.Experiment(self.expName, self.params, backend='sqlite')
+        for i in range(6):
+            exp.set('param1', i)
+            exp.add_result(10 - i, data={'tag': 'run' + str(i), 'curve': [i]})
+        self.assertEqual(exp.count(), 6)
+        self.assertEqual(exp.minimum().result, 5)
+        self.assertEqual(exp.minimum().param1, 5)
+        self.assertEqual(exp.maximum().curve, [0])
+        self.assertEqual([r.result for r in exp.top(3)], [5, 6, 7])
+        results = exp.filter((ro.Field('param1') >= 2) & (ro.Field('result') > 6))
+        self.assertEqual(sorted(r.param1 for r in results), [2, 3])
+        results = exp.filter(ro.Field('tag') == 'run1')
+        self.assertEqual([r.result for r in results], [9])
+        # Non-scalar keys fall back to calling the condition.
+        results = exp.filter(ro.Field('curve') == [4])
+        self.assertEqual([r.param1 for r in results], [4])
+        results = exp.filter(lambda r: r.result > 9)
+        self.assertEqual([r.result for r in results], [10])
+        self.assertEqual(len(exp.list().filter(ro.Field('param1') < 1)), 1)
+        # Failed trials are not ranked.
+        exp.add_result(None, data={'status': 'failed'})
+        self.assertEqual([r.result for r in exp.top(2)], [5, 6])
+        self.assertEqual(exp.maximum().result, 10)
+
+    def test_sqlite_column_case(self):
+        exp = ro.Experiment(self.expName, backend='sqlite')
+        exp.add_result(1, data={'lr': 0.1, 'LR': 2})
+        exp.add_result(2, data={'LR': 3, 'Result': 4})
+        self.assertEqual(exp.count(), 2)
+        self.assertEqual(exp.minimum().LR, 2)
+        self.assertEqual(exp.maximum().Result, 4)
+        results = exp.filter(ro.Field('LR') == 3)
+        self.assertEqual([r.result for r in results], [2])
+        results = exp.filter(ro.Field('lr') < 1.0)
+        self.assertEqual([r.result for r in results], [1])
+
+    def test_add_results_records(self):
+        for backend in ['json', 'log', 'sqlite']:
+            exp = ro.Experiment(self.expName, self.params, backend=backend)
+            exp.set('param1', 7)
+            exp.add_results([
+                {'result': 1, 'data': {'epoch': 1}},
+                {'result': 2, 'params': {'param1': 3},
+                 'attachment': {'w': [1, 2]}},
+            ])
+            self.assertEqual(exp.count(), 2)
+            self.assertEqual(exp.minimum().param1, 7)
+            self.assertEqual(exp.minimum().epoch, 1)
+            self.assertEqual(exp.maximum().param1, 3)
+            self.assertEqual(exp.maximum().attachment, {'w': [1, 2]})
+            if backend == 'json':
+                journal_path = os.path.join(exp.experiment_path, JOURNAL_DIR)
+                self.assertEqual(os.listdir(journal_path), [])
+            exp.storage.clear()
+
+    def test_recover_journal(self):
+        exp = ro.Experiment(self.expName, self.params)
+        # A writer crashed after committing its batch to the journal.
+        journal_path = os.path.join(exp.experiment_path, JOURNAL_DIR)
+        os.makedirs(journal_path)
+        entries = [('a', {'result': 1, 'param1': 1}),
+                   ('b', {'result': 2, 'param1': 2})]
+        attachments = [('b', {'x': 2})]
+        with open(os.path.join(journal_path, 'batch.pk'), 'wb') as f:
+            pk.dump((entries, attachments), f)
+        # And another one crashed before committing.
+        with open(os.path.join(journal_path, 'other.tmp'), 'wb') as f:
+            pk.dump(([('c', {'result': 3})], []), f)
+        self.assertEqual(exp.count(), 0)
+        exp = ro.Experiment(self.expName, self.params)
+        self.assertEqual(exp.count(), 2)
+        self.assertEqual(exp.maximum().attachment, {'x': 2})
+        self.assertFalse(os.path.exists(os.path.join(journal_path,
+                                                     'batch.pk')))
+
+    def test_recover_partial_batch(self):
+        exp = ro.Experiment(self.expName, self.params)
+        journal_path = os.path.join(exp.experiment_path, JOURNAL_DIR)
+        os.makedirs(journal_path)
+        # Without journaled batches, the results folder is not listed.
+        listed = []
+        listdir = os.listdir
+        os.listdir = lambda path: listed.append(path) or listdir(path)
+        try:
+            ro.Experiment(self.expName, self.params)
+        finally:
+            os.listdir = listdir
+        self.assertEqual(listed, [journal_path])
+        # Result files not yet indexed are not visible.
+        for name in ['a', 'b']:
+            with open(os.path.join(exp.experiment_path,
+                                   name + '.json.batch.tmp'), 'w') as f:
+                json.dump({'result': 1}, f)
+        self.assertEqual(exp.count(), 0)
+        # Once indexed, the whole batch is visible before the renames.
+        exp.storage.index.extend([('a', {'result': 1}), ('b', {'result': 2})])
+        self.assertEqual(exp.count(), 2)
+        with open(os.path.join(journal_path, 'batch.pk'), 'wb') as f:
+            pk.dump(([('a', {'result': 1}), ('b', {'result': 2})], []), f)
+        # Temporary files left by crashed writers are removed.
+        orphans = [os.path.join(journal_path, 'other.tmp'),
+                   os.path.join(exp.experiment_path, 'c.json.other.tmp')]
+        for path in orphans:
+            open(path, 'w').close()
+            os.utime(path, (0, 0))
+        exp = ro.Experiment(self.expName, self.params)
+        self.assertEqual(exp.count(), 2)
+        self.assertEqual(sorted(f for f in os.listdir(exp.experiment_path)
+                                if f.endswith('.json') or
+                                f.endswith('.tmp')), ['a.json', 'b.json'])
+        self.assertEqual(os.listdir(journal_path), [])
+
+    def test_result_loader(self):
+        for threads in [True, False]:
+            loader = ro.ResultLoader(threshold=5, workers=2, threads=threads)
+            exp = ro.Experiment(self.expName, self.params, loader=loader)
+            paths = []
+            for i in range(20):
+                paths.append(os.path.join(exp.experiment_path,
+                                          str(i) + '.json'))
+                with open(paths[-1], 'w') as f:
+                    json.dump({'result': i}, f)
+            loaded = loader.load(paths)
+            self.assertEqual([n for n, s in loaded],
+                             [str(i) for i in range(20)])
+            self.assertEqual([s['result'] for n, s in loaded], list(range(20)))
+            pool = loader._pool
+            self.assertEqual(exp.count(), 20)
+            self.assertTrue(loader._pool is pool)
+            self.assertEqual(exp.minimum().result, 0)
+            loader.close()
+            self.assertTrue(loader._pool is None)
+            exp.storage.clear()
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            ro.Experiment(self.expName, backend='asdf')
+
+    def test_migrate(self):
+        exp = ro.Experiment(self.expName, self.params)
+        for i in range(4):
+            exp.add_result(i)
+        self.assertEqual(migrate(exp.experiment_path, 'json', 'log',
+                                 remove=True), 4)
+        self.assertEqual(exp.count(), 0)
+        exp = ro.Experiment(self.expName, self.params, backend='log')
+        self.assertEqual(exp.count(), 4)
+        self.assertEqual(exp.minimum().result, 0)
+        self.assertEqual(migrate(exp.experiment_path, 'log', 'sqlite'), 4)
+        exp = ro.Experiment(self.expName, self.params, backend='sqlite')
+        self.assertEqual(exp.count(), 4)
+        self.assertEqual(exp.maximum().result, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()